@@ -0,0 +1,181 @@
+"""Per-call latency of every helper.database.Database method on a big user collection.
+
+Usage:
+    python benchmarks/bench_database.py [--url mongodb://localhost:27017] [--users 1000000] [--calls 2000]
+
+Needs a local mongod. The `renamer_bench` database (see --db) is filled
+with `--users` synthetic users once and reused by later runs; --reseed
+starts it over. Each method is called `--calls` times on random users and
+its p50 / p95 / p99 latency printed. The user cache is cleared before
+every call so the numbers are Mongo's, unless --cache is given.
+
+total_users_count is shown next to the count_documents({}) it replaced.
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class FakeBot:
+    # add_user sends the new user to LOG_CHANNEL; nothing is sent here
+    mention = "bench"
+
+    async def send_message(self, *args, **kwargs):
+        pass
+
+
+class FakeMessage:
+
+    def __init__(self, id):
+        self.from_user = FakeUser(id)
+
+
+class FakeUser:
+
+    def __init__(self, id):
+        self.id = id
+        self.first_name = self.last_name = self.username = self.mention = "bench"
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def seed(db, users, reseed):
+    if reseed:
+        await db.col.drop()
+    have = await db.col.estimated_document_count()
+    if have >= users:
+        return
+    print(f"Inserting {users - have} users...")
+    batch = []
+    for id in range(have + 1, users + 1):
+        user = db.new_user(id)
+        if id % 3 == 0:
+            user.update(caption="{filename}", format_template="[S{season}E{episode}] {quality}", media_type="video")
+        batch.append(user)
+        if len(batch) == 10000:
+            await db.col.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.col.insert_many(batch, ordered=False)
+
+
+async def run(args):
+    from helper.database import madflixbotz as db
+
+    await seed(db, args.users, args.reseed)
+    await db.ensure_indexes()
+    await db.jobs.delete_many({'owner': 'bench'})
+    await db.broadcasts.delete_many({'_id': {'$regex': '^bench'}})
+
+    bot = FakeBot()
+    owner = "bench"
+    new_ids = iter(range(args.users + 1, args.users + 100 * args.calls))
+    job_ids = []
+    added = []  # users add_user created, for delete_user and delete_users
+
+    def user():
+        return random.randint(1, args.users)
+
+    def now():
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    async def insert_job():
+        job_id = f"bench{len(job_ids)}"
+        job_ids.append(job_id)
+        created = now()
+        await db.insert_job({
+            '_id': job_id, 'user_id': user(), 'file_unique_id': job_id, 'chat_id': 1, 'message_id': 1,
+            'state': 'queued', 'active': True, 'owner': owner, 'lease_until': created, 'attempts': 1,
+            'shard': None, 'created_at': created, 'updated_at': created,
+        })
+
+    async def add_user():
+        added.append(next(new_ids))
+        await db.add_user(bot, FakeMessage(added[-1]))
+
+    async def get_user_ids():
+        await db.get_user_ids(after=user(), limit=500)
+
+    async def get_all_users():
+        cursor = await db.get_all_users()
+        await cursor.to_list(100)  # first batch, like a broadcast's first page
+
+    # (name, call) in an order where each call finds what it needs
+    calls = [
+        ("get_user", lambda: db.get_user(user())),
+        ("is_user_exist", lambda: db.is_user_exist(user())),
+        ("get_user_settings", lambda: db.get_user_settings(user())),
+        ("get_thumbnail", lambda: db.get_thumbnail(user())),
+        ("get_caption", lambda: db.get_caption(user())),
+        ("get_format_template", lambda: db.get_format_template(user())),
+        ("get_media_preference", lambda: db.get_media_preference(user())),
+        ("update_user_settings", lambda: db.update_user_settings(user(), caption="bench", media_type="document")),
+        ("set_thumbnail", lambda: db.set_thumbnail(user(), None)),
+        ("set_caption", lambda: db.set_caption(user(), "{filename}")),
+        ("set_format_template", lambda: db.set_format_template(user(), "{episode}")),
+        ("set_media_preference", lambda: db.set_media_preference(user(), "video")),
+        ("add_user", add_user),
+        ("delete_user", lambda: db.delete_user(added.pop() if added else next(new_ids))),
+        ("delete_users", lambda: db.delete_users([added.pop() if added else next(new_ids) for _ in range(10)])),
+        ("total_users_count", db.total_users_count),
+        ("count_documents({})", lambda: db.col.count_documents({})),
+        ("get_user_ids", get_user_ids),
+        ("get_all_users", get_all_users),
+        ("save_broadcast", lambda: db.save_broadcast({'_id': f"bench{user() % 10}", 'status': 'done'})),
+        ("get_running_broadcasts", db.get_running_broadcasts),
+        ("save_rename_result", lambda: db.save_rename_result(f"bench{user() % 1000}", "file", 1)),
+        ("get_rename_result", lambda: db.get_rename_result(f"bench{user() % 1000}")),
+        ("delete_rename_result", lambda: db.delete_rename_result(f"bench{user() % 1000}")),
+        ("insert_job", insert_job),
+        ("update_job", lambda: db.update_job(random.choice(job_ids), owner, {'state': 'downloading'})),
+        ("renew_job_leases", lambda: db.renew_job_leases(job_ids[-50:], owner, now())),
+        ("release_jobs", lambda: db.release_jobs(job_ids[-50:], owner, now())),
+        ("claim_job", lambda: db.claim_job(owner, now(), now())),
+        ("count_jobs_by_state", db.count_jobs_by_state),
+        ("ensure_indexes", db.ensure_indexes),
+    ]
+    # A full collection scan and a round of index builds; a few calls tell enough
+    slow = {"count_documents({})": 20, "ensure_indexes": 20}
+
+    print(f"{'method':24} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, call in calls:
+        times = []
+        for _ in range(slow.get(name, args.calls)):
+            if not args.cache:
+                db.user_cache.clear()
+            start = time.perf_counter()
+            await call()
+            times.append(time.perf_counter() - start)
+        times.sort()
+        print(f"{name:24} {len(times):>6} {statistics.median(times) * 1000:>9.3f} "
+              f"{percentile(times, 0.95) * 1000:>9.3f} {percentile(times, 0.99) * 1000:>9.3f}")
+
+    # Leave the seeded users; drop what the run itself added
+    await db.jobs.delete_many({'owner': owner})
+    await db.broadcasts.delete_many({'_id': {'$regex': '^bench'}})
+    await db.results.delete_many({'_id': {'$regex': '^bench'}})
+    await db.col.delete_many({'_id': {'$gt': args.users}})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="renamer_bench")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--reseed", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="keep the user cache between calls")
+    args = parser.parse_args()
+    # helper.database connects with these when it is imported
+    os.environ["DB_URL"], os.environ["DB_NAME"] = args.url, args.db
+    asyncio.run(run(args))
@@ -0,0 +1,77 @@
+"""Compare the old inline hachoir call with helper.metadata.extract_metadata.
+
+Usage:
+    python benchmarks/bench_metadata.py sample.mp4 sample.mkv sample.mp3 ...
+
+For each file it reports the time taken by the old
+`extractMetadata(createParser(path))` call, by `read_metadata` (the
+QUALITY_FASTEST header read), and by `extract_metadata` through the worker
+pool. It also reports the longest event-loop stall seen while each variant
+ran, which is what other users' progress updates feel.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hachoir.metadata import extractMetadata  # noqa: E402
+from hachoir.parser import createParser  # noqa: E402
+from helper.metadata import extract_metadata, read_metadata  # noqa: E402
+
+RUNS = 5
+
+
+def legacy(path):
+    metadata = extractMetadata(createParser(path))
+    return metadata.get('duration').seconds if metadata and metadata.has("duration") else 0
+
+
+async def measure(run):
+    """Run `run` RUNS times while a ticker measures the worst loop stall."""
+    stall = 0.0
+    stop = False
+
+    async def ticker():
+        nonlocal stall
+        while not stop:
+            before = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stall = max(stall, time.perf_counter() - before - 0.001)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        await run()
+        timings.append(time.perf_counter() - start)
+    stop = True
+    await tick
+    return min(timings), stall
+
+
+async def main(paths):
+    print(f"{'file':30} {'variant':18} {'best ms':>9} {'loop stall ms':>14}")
+    for path in paths:
+        async def inline_legacy():
+            legacy(path)
+
+        async def inline_fast():
+            read_metadata(path)
+
+        async def pooled():
+            await extract_metadata(path)
+
+        await extract_metadata(path)  # warm the pool up
+        for name, run in (("inline (old)", inline_legacy), ("inline fastest", inline_fast), ("worker pool", pooled)):
+            best, stall = await measure(run)
+            print(f"{os.path.basename(path)[:30]:30} {name:18} {best * 1000:9.1f} {stall * 1000:14.1f}")
+        print(f"{'':30} result: {await extract_metadata(path)}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    asyncio.run(main(sys.argv[1:]))
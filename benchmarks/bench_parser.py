@@ -0,0 +1,131 @@
+"""Compare helper.parser.parse_filename with the old regex cascade.
+
+Usage:
+    python benchmarks/bench_parser.py [names.txt]
+
+Without an argument a deterministic corpus of ~3000 anime/TV style release
+names is generated. Pass a file with one filename per line to run against a
+real dump (e.g. names collected from the bot's log channel).
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper.parser import parse_filename  # noqa: E402
+
+# --- the cascade that used to live in plugins/file_rename.py ---------------
+pattern1 = re.compile(r'S(\d+)(?:E|EP)(\d+)')
+pattern2 = re.compile(r'S(\d+)\s*(?:E|EP|-\s*EP)(\d+)')
+pattern3 = re.compile(r'(?:[([<{]?\s*(?:E|EP)\s*(\d+)\s*[)\]>}]?)')
+pattern3_2 = re.compile(r'(?:\s*-\s*(\d+)\s*)')
+pattern4 = re.compile(r'S(\d+)[^\d]*(\d+)', re.IGNORECASE)
+patternX = re.compile(r'(\d+)')
+pattern5 = re.compile(r'\b(?:.*?(\d{3,4}[^\dp]*p).*?|.*?(\d{3,4}p))\b', re.IGNORECASE)
+pattern6 = re.compile(r'[([<{]?\s*4k\s*[)\]>}]?', re.IGNORECASE)
+pattern7 = re.compile(r'[([<{]?\s*2k\s*[)\]>}]?', re.IGNORECASE)
+pattern8 = re.compile(r'[([<{]?\s*HdRip\s*[)\]>}]?|\bHdRip\b', re.IGNORECASE)
+
+
+def legacy_episode(filename):
+    for pattern, group in ((pattern1, 2), (pattern2, 2), (pattern3, 1),
+                           (pattern3_2, 1), (pattern4, 2), (patternX, 1)):
+        match = pattern.search(filename)
+        if match:
+            return match.group(group)
+    return None
+
+
+def legacy_quality(filename):
+    match = pattern5.search(filename)
+    if match:
+        return match.group(1) or match.group(2)
+    for pattern, label in ((pattern6, "4k"), (pattern7, "2k"), (pattern8, "HdRip")):
+        if pattern.search(filename):
+            return label
+    return "Unknown"
+
+
+# --- corpus ------------------------------------------------------------------
+TITLES = [
+    "Naruto Shippuden", "One Piece", "Attack on Titan", "Jujutsu Kaisen",
+    "Demon Slayer Kimetsu no Yaiba", "Spy x Family", "Chainsaw Man",
+    "Breaking Bad", "The Last of Us", "House of the Dragon", "Solo Leveling",
+    "Frieren Beyond Journey's End", "Bleach Thousand-Year Blood War",
+    "My Hero Academia", "Vinland Saga", "The Boys", "Loki", "Dark",
+    "Money Heist", "Stranger Things", "Tokyo Revengers", "Black Clover",
+]
+GROUPS = ["SubsPlease", "Erai-raws", "HorribleSubs", "Judas", "ASW", "EMBER",
+          "Anime Time", "Madflix_Bots", "YTS", "NTb", "FLUX", "PSA"]
+QUALITIES = ["1080p", "720p", "480p", "2160p", "360p", "4K", "2k", "HDRip",
+             "1080P", "WEB-DL 1080p", ""]
+CODECS = ["x264", "x265", "HEVC", "H.264", "AVC", "10bit", ""]
+EXTS = [".mkv", ".mp4", ".avi", ".webm"]
+STYLES = [
+    "[{group}] {title} - {ep:02d} ({quality}) [{codec}]{ext}",
+    "{title} S{season:02d}E{ep:02d} {quality} {codec}{ext}",
+    "{title}.S{season:02d}E{ep:02d}.{quality}.WEB.{codec}-{group}{ext}",
+    "{title} S{season:02d} - EP{ep:02d} - {quality} [Dual Audio] @{group}{ext}",
+    "{title} S{season:02d} EP{ep:02d} [{quality}]{ext}",
+    "{title} Season {season} Episode {ep} {quality}{ext}",
+    "[{group}] {title} E{ep:03d} [{quality}][{codec}]{ext}",
+    "{title} S{season} {ep:02d} {quality}{ext}",
+    "{title} {ep:04d} {quality}{ext}",
+    "{title} - Movie ({year}) {quality} {codec}{ext}",
+]
+
+
+def build_corpus(size=3000, seed=1):
+    rnd = random.Random(seed)
+    names = []
+    for _ in range(size):
+        names.append(rnd.choice(STYLES).format(
+            title=rnd.choice(TITLES), group=rnd.choice(GROUPS),
+            quality=rnd.choice(QUALITIES), codec=rnd.choice(CODECS),
+            ext=rnd.choice(EXTS), season=rnd.randint(1, 12),
+            ep=rnd.randint(1, 1100), year=rnd.randint(1995, 2025),
+        ))
+    return names
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            corpus = [line.strip() for line in f if line.strip()]
+    else:
+        corpus = build_corpus()
+
+    mismatches = 0
+    for name in corpus:
+        parsed = parse_filename(name)
+        if (parsed.episode, parsed.quality or "Unknown") != (legacy_episode(name), legacy_quality(name)):
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"MISMATCH {name!r}: {parsed} vs {legacy_episode(name)!r}, {legacy_quality(name)!r}")
+
+    def run_legacy():
+        for name in corpus:
+            legacy_episode(name)
+            legacy_quality(name)
+
+    def run_parser():
+        for name in corpus:
+            parse_filename(name)
+
+    repeat = 5
+    legacy = min(timeit.repeat(run_legacy, number=1, repeat=repeat))
+    single = min(timeit.repeat(run_parser, number=1, repeat=repeat))
+    per_legacy = legacy / len(corpus) * 1e6
+    per_single = single / len(corpus) * 1e6
+
+    print(f"corpus            : {len(corpus)} filenames")
+    print(f"result mismatches : {mismatches}")
+    print(f"legacy cascade    : {per_legacy:7.2f} us/file")
+    print(f"parse_filename    : {per_single:7.2f} us/file  ({per_legacy / per_single:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
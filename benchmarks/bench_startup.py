@@ -0,0 +1,120 @@
+"""Cold-start budget: import cost per module and time to the first handled message.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5]
+    python benchmarks/bench_startup.py --live [--timeout 300]
+
+The default mode imports everything bot.py and its plugins import, in a
+fresh interpreter per run with `-X importtime`. It prints the median
+cumulative import time of each top-level module, slowest first. It also
+lists the heavy modules that were not imported at all, which is the point
+of importing PIL and hachoir lazily.
+
+--live starts bot.py for real (it needs the usual environment), polls its
+/metrics endpoint and prints the renamer_startup_seconds phases as they
+appear: imports, connected, ready and first_update. Send the bot any
+message to record first_update.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What bot.py and the plugin loader import, without starting the bot
+MODULES = [
+    "config", "pyrogram", "pyrogram.raw.all", "aiohttp", "motor.motor_asyncio",
+    "helper.database", "helper.broadcast", "helper.storage", "helper.jobs", "helper.shutdown",
+    "helper.shards", "helper.transfer", "helper.metadata", "helper.thumbnail",
+    "plugins.admin_panel", "plugins.auto_rename", "plugins.file_rename", "plugins.force_subs", "plugins.start_&_cb",
+]
+HEAVY = ["PIL", "hachoir", "pytz"]
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def import_script():
+    lines = ["import importlib, sys", f"sys.path.insert(0, {ROOT!r})"]
+    lines += [f"importlib.import_module({name!r})" for name in MODULES]
+    lines.append(f"print(','.join(m for m in {HEAVY!r} if m in sys.modules))")
+    return "\n".join(lines)
+
+
+def one_run(env):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", import_script()],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode:
+        sys.exit(proc.stderr[-2000:])
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and not match.group(3):  # top level: imported by our script
+            cumulative[match.group(4)] = int(match.group(2)) / 1e6
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return wall, cumulative, loaded
+
+
+def offline(runs):
+    env = dict(os.environ)
+    env.setdefault("DB_URL", "mongodb://localhost:27017")
+    walls, per_module, loaded = [], {}, []
+    for _ in range(runs):
+        wall, cumulative, loaded = one_run(env)
+        walls.append(wall)
+        for name, seconds in cumulative.items():
+            per_module.setdefault(name, []).append(seconds)
+
+    rows = sorted(((statistics.median(v), k) for k, v in per_module.items()), reverse=True)
+    print(f"{'module':32} {'cumulative ms':>14}")
+    for seconds, name in rows[:25]:
+        print(f"{name:32} {seconds * 1000:>14.1f}")
+    print(f"\nInterpreter start + imports: {statistics.median(walls) * 1000:.0f} ms (median of {runs})")
+    lazy = [m for m in HEAVY if m not in loaded]
+    print(f"Not imported at startup: {', '.join(lazy) or 'none'}")
+
+
+def live(timeout):
+    proc = subprocess.Popen([sys.executable, "bot.py"], cwd=ROOT)
+    seen = {}
+    phases = ("imports", "connected", "ready", "first_update")
+    deadline = time.monotonic() + timeout
+    try:
+        while len(seen) < len(phases) and time.monotonic() < deadline and proc.poll() is None:
+            time.sleep(0.2)
+            try:
+                text = urllib.request.urlopen("http://127.0.0.1:8080/metrics", timeout=1).read().decode()
+            except OSError:
+                continue
+            for phase, value in re.findall(r'renamer_startup_seconds\{phase="(\w+)"\} ([\d.e+-]+)', text):
+                if phase not in seen:
+                    seen[phase] = float(value)
+                    print(f"{phase:14} {seen[phase]:7.2f} s")
+                    if phase == "ready":
+                        print("Send the bot a message to measure first_update...")
+    finally:
+        proc.terminate()
+        proc.wait()
+    missing = [phase for phase in phases if phase not in seen]
+    if missing:
+        print(f"Not reached: {', '.join(missing)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+    if args.live:
+        live(args.timeout)
+    else:
+        offline(args.runs)
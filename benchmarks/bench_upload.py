@@ -0,0 +1,64 @@
+"""Measure upload throughput of helper.transfer.upload_file with a stub transport.
+
+Usage:
+    python benchmarks/bench_upload.py [--size 512] [--workers 1,4,8,16] [--fail 0.02]
+
+A temporary file of `--size` MB is uploaded through a stub save_part that
+waits `--latency` ms per part plus the part's time at `--bandwidth` MB/s,
+like one round trip to Telegram per part. `--fail` makes that share of
+calls raise, so the per-part retries are exercised too. Workers 1 is the
+serial upload pyrogram does on a single connection.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper.transfer import PART_SIZE, upload_file  # noqa: E402
+
+MB = 1024 * 1024
+
+
+class StubTransport:
+
+    def __init__(self, latency, bandwidth, fail):
+        self.delay = latency + PART_SIZE / bandwidth
+        self.fail = fail
+        self.parts = {}
+        self.failures = 0
+
+    async def save_part(self, index, total_parts, data):
+        await asyncio.sleep(self.delay)
+        if random.random() < self.fail:
+            self.failures += 1
+            raise ConnectionError("stub part failure")
+        self.parts[index] = len(data)
+
+
+async def main(args):
+    with tempfile.NamedTemporaryFile() as f:
+        f.truncate(args.size * MB)
+        f.flush()
+        print(f"{'workers':>7} {'seconds':>8} {'MB/s':>8} {'failed parts':>13}")
+        for workers in (int(w) for w in args.workers.split(",")):
+            transport = StubTransport(args.latency / 1000, args.bandwidth * MB, args.fail)
+            start = time.perf_counter()
+            size, parts = await upload_file(transport, f.name, workers=workers, retries=5)
+            elapsed = time.perf_counter() - start
+            assert len(transport.parts) == parts and sum(transport.parts.values()) == size
+            print(f"{workers:>7} {elapsed:>8.2f} {size / MB / elapsed:>8.1f} {transport.failures:>13}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=512, help="file size in MB")
+    parser.add_argument("--workers", default="1,4,8,16")
+    parser.add_argument("--latency", type=float, default=20, help="ms per part")
+    parser.add_argument("--bandwidth", type=float, default=50, help="MB/s per part in flight")
+    parser.add_argument("--fail", type=float, default=0.0, help="share of part uploads that fail")
+    asyncio.run(main(parser.parse_args()))
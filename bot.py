@@ -1,12 +1,27 @@
+from time import monotonic
+boot_started = monotonic()  # before the imports below, which are most of the startup time
+
 from datetime import datetime
-from pytz import timezone
 from pyrogram import Client, __version__
+from pyrogram.handlers import MessageHandler
 from pyrogram.raw.all import layer
 from config import Config
+from helper.broadcast import resume_broadcasts
+from helper import metrics
+from helper.storage import cleanup_orphans, start_scratch
+from helper.database import madflixbotz
+from helper.jobs import job_queue
+from helper.scheduler import scheduler
+from helper.shutdown import drain
+from helper.shards import listen_for_wakeups, supervisor, worker_index
+from helper.transfer import UploadSource, stop_media_sessions
 from aiohttp import web
 import asyncio
+import logging
 import pyrogram.utils
 
+logging.basicConfig(level=Config.LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
 pyrogram.utils.MIN_CHAT_ID = -999999999999
 pyrogram.utils.MIN_CHANNEL_ID = -1009999999999
 
@@ -14,34 +29,56 @@ pyrogram.utils.MIN_CHANNEL_ID = -1009999999999
 async def health_check(request):
     return web.Response(text="OK", status=200)
 
+# Prometheus scrape route handler
+async def metrics_handler(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
 class Bot(Client):
     def __init__(self):
+        # A rename worker (WORKER_PROCESSES) has its own session and gets
+        # no updates; the front process handles those
+        worker = worker_index is not None
         super().__init__(
-            name="renamer",
+            name=f"renamer-worker{worker_index}" if worker else "renamer",
             api_id=Config.API_ID,
             api_hash=Config.API_HASH,
             bot_token=Config.BOT_TOKEN,
             workers=200,
-            plugins={"root": "plugins"},
+            plugins=None if worker else {"root": "plugins"},
+            no_updates=worker,
             sleep_threshold=15,
         )
         self.health_app = None
         self.runner = None
+        self.loop_monitor = None
+        self.scratch_cleaner = None
+        self.job_worker = None
+        self.startup = None
+        self.first_update_handler = None
+        metrics.STARTUP_SECONDS.set(monotonic() - boot_started, phase="imports")
 
     async def start_health_server(self):
         """Start the health check server"""
         try:
             self.health_app = web.Application()
             self.health_app.router.add_get('/health', health_check)
+            self.health_app.router.add_get('/metrics', metrics_handler)
             
             self.runner = web.AppRunner(self.health_app)
             await self.runner.setup()
-            site = web.TCPSite(self.runner, "0.0.0.0", 8080)
+            port = 8080 if worker_index is None else 8081 + worker_index
+            site = web.TCPSite(self.runner, "0.0.0.0", port)
             await site.start()
-            print("Health check server started on port 8080")
+            print(f"Health check server started on port {port}")
         except Exception as e:
             print(f"Failed to start health server: {e}")
 
+    async def save_file(self, path, *args, **kwargs):
+        # Big renames pass an UploadSource that uploads its own parts
+        if isinstance(path, UploadSource):
+            return await path.save(self, *args, **kwargs)
+        return await super().save_file(path, *args, **kwargs)
+
     async def stop_health_server(self):
         """Stop the health check server"""
         if self.runner:
@@ -49,6 +86,7 @@ class Bot(Client):
 
     async def start(self):
         await super().start()
+        metrics.STARTUP_SECONDS.set(monotonic() - boot_started, phase="connected")
         me = await self.get_me()
         self.mention = me.mention
         self.username = me.username
@@ -56,22 +94,59 @@ class Bot(Client):
 
         # Start health check server regardless of webhook config
         await self.start_health_server()
-            
+        self.loop_monitor = asyncio.create_task(metrics.monitor_event_loop())
+        start_scratch()
+        self.scratch_cleaner = asyncio.create_task(cleanup_orphans())
+
+        if worker_index is not None:
+            # Rename worker: the rename pipeline without its handlers, fed by
+            # the job queue whenever the front pokes us
+            import plugins.file_rename  # noqa: F401  registers the resume hook
+            listen_for_wakeups(job_queue)
+            self.job_worker = asyncio.create_task(job_queue.run(self, lambda: scheduler.has_capacity))
+            print(f"Rename Worker {worker_index} Is Started.....✨️")
+            return
+
+        # Keep our job leases alive and take over jobs of workers that died;
+        # with WORKER_PROCESSES the workers do that instead
+        if Config.JOB_QUEUE:
+            if supervisor is not None:
+                await supervisor.start()
+            else:
+                self.job_worker = asyncio.create_task(job_queue.run(self, lambda: scheduler.has_capacity))
+
+        # Nothing left is needed to answer users, so it runs in the background
+        self.startup = asyncio.create_task(self.finish_startup())
+        self.first_update_handler = MessageHandler(self.first_update)
+        self.add_handler(self.first_update_handler, group=-1)
+        metrics.STARTUP_SECONDS.set(monotonic() - boot_started, phase="ready")
         print(f"{me.first_name} Is Started.....✨️")
-        for id in Config.ADMIN:
+
+    async def first_update(self, client, message):
+        # Time to the first message users see handled; measured once
+        metrics.STARTUP_SECONDS.set(monotonic() - boot_started, phase="first_update")
+        self.remove_handler(self.first_update_handler, group=-1)
+
+    async def finish_startup(self):
+        # Indexes, broadcasts cut off by a restart, the LOG_CHANNEL notice;
+        # one failing doesn't hold up the others
+        for step in (madflixbotz.ensure_indexes, lambda: resume_broadcasts(self), self.announce_start):
             try:
-                await self.send_message(Config.LOG_CHANNEL, f"**{me.first_name} Is Started.....✨️**")
-            except:
-                pass
-                
+                await step()
+            except Exception:
+                logging.exception("Startup step failed")
+
+    async def announce_start(self):
+        # One notice per start; it used to go to LOG_CHANNEL once per admin
         if Config.LOG_CHANNEL:
+            from pytz import timezone
             try:
                 curr = datetime.now(timezone("Asia/Kolkata"))
                 date = curr.strftime('%d %B, %Y')
                 time = curr.strftime('%I:%M:%S %p')
                 await self.send_message(
                     Config.LOG_CHANNEL,
-                    f"**{me.mention} Is Restarted !!**\n\n"
+                    f"**{self.mention} Is Restarted !!**\n\n"
                     f"📅 Date : `{date}`\n"
                     f"⏰ Time : `{time}`\n"
                     f"🌐 Timezone : `Asia/Kolkata`\n\n"
@@ -80,14 +155,25 @@ class Bot(Client):
             except:
                 print("Please Make This Is Admin In Your Log Channel")
 
-    async def stop(self):
+    async def stop(self, *args, **kwargs):
         """Stop the bot and cleanup health check server"""
+        # Deploys stop the bot with SIGTERM; give running renames a moment
+        # and hand the rest over before disconnecting
+        await drain(Config.SHUTDOWN_DRAIN_TIMEOUT)
+        if supervisor is not None:
+            await supervisor.stop(Config.SHUTDOWN_DRAIN_TIMEOUT + 5)
+        for task in (self.loop_monitor, self.scratch_cleaner, self.job_worker, self.startup):
+            if task:
+                task.cancel()
         await self.stop_health_server()
-        await super().stop()
+        await stop_media_sessions(self)
+        await super().stop(*args, **kwargs)
 
-# Run the bot
-app = Bot()
-app.run()
+# Run the bot; the guard keeps metadata pool workers, which import this
+# file as __mp_main__, from starting a second one
+if __name__ == "__main__":
+    app = Bot()
+    app.run()
 
 # Jishu Developer 
 # Don't Remove Credit 🥺
@@ -10,6 +10,11 @@ class Config(object):
     # database config
     DB_NAME = os.environ.get("DB_NAME","madflixbotz")     
     DB_URL  = os.environ.get("DB_URL","")
+    DB_MAX_POOL_SIZE   = int(os.environ.get("DB_MAX_POOL_SIZE", "50"))    # connections per bot process
+    DB_MIN_POOL_SIZE   = int(os.environ.get("DB_MIN_POOL_SIZE", "2"))     # kept open between bursts
+    DB_SELECT_TIMEOUT  = float(os.environ.get("DB_SELECT_TIMEOUT", "10"))  # seconds to find a usable server
+    DB_CONNECT_TIMEOUT = float(os.environ.get("DB_CONNECT_TIMEOUT", "5"))
+    DB_SOCKET_TIMEOUT  = float(os.environ.get("DB_SOCKET_TIMEOUT", "30"))  # per query, 0 waits forever
  
     # other configs
     BOT_UPTIME  = time.time()
@@ -21,6 +26,101 @@ class Config(object):
     # wes response configuration     
     WEBHOOK = bool(os.environ.get("WEBHOOK", "True"))
 
+    # rename queue config
+    MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", "6"))
+    MAX_JOBS_PER_USER   = int(os.environ.get("MAX_JOBS_PER_USER", "2"))
+    DOWNLOAD_SLOTS      = int(os.environ.get("DOWNLOAD_SLOTS", "3"))
+    UPLOAD_SLOTS        = int(os.environ.get("UPLOAD_SLOTS", "3"))
+    # re-send the stored file_id when only the caption changes
+    FAST_RENAME         = os.environ.get("FAST_RENAME", "True").lower() in ("true", "1", "yes")
+
+    # batch mode: files of one album, or sent this close together, are one job
+    BATCH_WINDOW    = float(os.environ.get("BATCH_WINDOW", "2"))  # seconds, 0 disables batching
+    BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "20"))
+    BATCH_PREFETCH  = int(os.environ.get("BATCH_PREFETCH", "1"))  # downloaded files waiting for upload
+
+    # streaming transfer config: upload while downloading, for big files
+    STREAM_TRANSFER  = os.environ.get("STREAM_TRANSFER", "False").lower() in ("true", "1", "yes")
+    STREAM_MIN_MB    = int(os.environ.get("STREAM_MIN_MB", "20"))
+    STREAM_MEMORY_MB = int(os.environ.get("STREAM_MEMORY_MB", "32"))   # per job
+    STREAM_SPILL_MB  = int(os.environ.get("STREAM_SPILL_MB", "256"))   # per job, on disk once memory is full
+
+    # parallel transfer config: big files move over several connections
+    PARALLEL_MIN_MB      = int(os.environ.get("PARALLEL_MIN_MB", "20"))
+    DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", "2"))
+    DOWNLOAD_WORKERS     = int(os.environ.get("DOWNLOAD_WORKERS", "8"))   # 1 MiB chunks in flight, 1 = pyrogram's own download
+    UPLOAD_CONNECTIONS   = int(os.environ.get("UPLOAD_CONNECTIONS", "2"))
+    UPLOAD_WORKERS       = int(os.environ.get("UPLOAD_WORKERS", "8"))     # 512 KiB parts in flight, 1 = pyrogram's own upload
+    TRANSFER_RETRIES     = int(os.environ.get("TRANSFER_RETRIES", "3"))   # per chunk / part
+
+    # durable job queue config
+    JOB_QUEUE              = os.environ.get("JOB_QUEUE", "True").lower() in ("true", "1", "yes")
+    JOB_LEASE              = int(os.environ.get("JOB_LEASE", "120"))              # seconds without a heartbeat before a job is taken over
+    JOB_HEARTBEAT_INTERVAL = int(os.environ.get("JOB_HEARTBEAT_INTERVAL", "30"))
+    JOB_MAX_ATTEMPTS       = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RETENTION          = int(os.environ.get("JOB_RETENTION", "86400"))       # finished jobs kept this long
+
+    # restart config: how long running renames get to finish
+    RESTART_DRAIN_TIMEOUT  = int(os.environ.get("RESTART_DRAIN_TIMEOUT", "600"))   # /restart
+    SHUTDOWN_DRAIN_TIMEOUT = int(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", "25"))   # SIGTERM from the host
+
+    # sharded worker config: 0 runs everything in one process
+    WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "0"))   # rename workers besides the front process
+
+    # user settings cache config
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+    USER_CACHE_TTL  = int(os.environ.get("USER_CACHE_TTL", "300"))
+
+    # force sub membership cache config (seconds per status)
+    FORCE_SUB_CACHE_SIZE     = int(os.environ.get("FORCE_SUB_CACHE_SIZE", "50000"))
+    FORCE_SUB_MEMBER_TTL     = int(os.environ.get("FORCE_SUB_MEMBER_TTL", "900"))
+    FORCE_SUB_NOT_MEMBER_TTL = int(os.environ.get("FORCE_SUB_NOT_MEMBER_TTL", "20"))
+    FORCE_SUB_BANNED_TTL     = int(os.environ.get("FORCE_SUB_BANNED_TTL", "3600"))
+
+    # progress message config
+    PROGRESS_INTERVAL         = float(os.environ.get("PROGRESS_INTERVAL", "5"))   # seconds between edits of one message
+    PROGRESS_WINDOW           = float(os.environ.get("PROGRESS_WINDOW", "10"))    # seconds of history used for speed/ETA
+    PROGRESS_EDITS_PER_SECOND = float(os.environ.get("PROGRESS_EDITS_PER_SECOND", "10"))
+
+    # processed thumbnail cache config
+    THUMB_CACHE_DIR = os.environ.get("THUMB_CACHE_DIR", "thumbs")
+    THUMB_CACHE_MB  = int(os.environ.get("THUMB_CACHE_MB", "100"))
+    THUMB_WORKERS   = int(os.environ.get("THUMB_WORKERS", "2"))
+
+    # metadata extraction config
+    METADATA_EXECUTOR = os.environ.get("METADATA_EXECUTOR", "process")  # process or thread
+    METADATA_WORKERS  = int(os.environ.get("METADATA_WORKERS", "2"))
+    METADATA_TIMEOUT  = float(os.environ.get("METADATA_TIMEOUT", "10"))
+
+    # broadcast config
+    BROADCAST_RATE    = float(os.environ.get("BROADCAST_RATE", "25"))  # messages per second
+    BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "10"))
+    BROADCAST_BATCH   = int(os.environ.get("BROADCAST_BATCH", "500"))
+    BROADCAST_RETRIES = int(os.environ.get("BROADCAST_RETRIES", "3"))
+
+    # duplicate upload detection config
+    DEDUP_TTL         = int(os.environ.get("DEDUP_TTL", "10"))  # seconds a finished file still counts as a duplicate
+    DEDUP_MAX_JOB_AGE = int(os.environ.get("DEDUP_MAX_JOB_AGE", "21600"))
+    DEDUP_MAX_KEYS    = int(os.environ.get("DEDUP_MAX_KEYS", "100000"))
+
+    # rename result cache config
+    RESULT_CACHE     = os.environ.get("RESULT_CACHE", "True").lower() in ("true", "1", "yes")
+    RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+
+    # scratch storage config
+    SCRATCH_DIR              = os.environ.get("SCRATCH_DIR", "downloads")
+    SCRATCH_QUOTA_MB         = int(os.environ.get("SCRATCH_QUOTA_MB", "0"))  # 0 = 90% of the free disk
+    SCRATCH_SMALL_DIR        = os.environ.get("SCRATCH_SMALL_DIR", "")  # e.g. /dev/shm/renamer
+    SCRATCH_SMALL_MAX_MB     = int(os.environ.get("SCRATCH_SMALL_MAX_MB", "50"))
+    SCRATCH_SMALL_QUOTA_MB   = int(os.environ.get("SCRATCH_SMALL_QUOTA_MB", "256"))
+    SCRATCH_CLEANUP_INTERVAL = int(os.environ.get("SCRATCH_CLEANUP_INTERVAL", "600"))
+
+    # logging and job tracing config
+    LOG_LEVEL         = os.environ.get("LOG_LEVEL", "INFO").upper()
+    TRACE_LOG         = os.environ.get("TRACE_LOG", "traces.jsonl")  # empty disables the file
+    TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.1"))  # failed jobs are always logged
+    TRACE_BUFFER      = int(os.environ.get("TRACE_BUFFER", "1000"))  # jobs kept for /timings
+
 
 class Txt(object):
     # part of text configuration
@@ -46,6 +146,10 @@ Use These Keywords To Setup Custom File Name
 
 <b>➻ Example :</b> <code> /autorename Naruto Shippuden S02 - EPepisode - quality  [Dual Audio] - @Madflix_Bots </code>
 
+Or Use Tokens In Braces : <code>{{title}}</code> <code>{{season}}</code> <code>{{episode}}</code> <code>{{quality}}</code> <code>{{codec}}</code> <code>{{group}}</code> <code>{{ext}}</code>, And <code>{{episode:02}}</code> For 05 Instead Of 5
+
+<b>➻ Example :</b> <code> /autorename {{title}} S{{season:02}}E{{episode:02}} [{{quality}}] - @Madflix_Bots </code>
+
 <b>➻ Your Current Auto Rename Format :</b> <code>{format_template}</code> """
     
     ABOUT_TXT = f"""<b>🤖 My Name :</b> <a href='https://t.me/AutoRenameXBot'>Auto Rename Bot ⚡</a>
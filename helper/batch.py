@@ -0,0 +1,53 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Batcher:
+    """Collects items per key until `window` seconds pass without a new one
+    (or `max_size` items arrive), then hands them all to `flush(key, items)`.
+
+    With a window of 0 every item is flushed on its own, right away.
+    """
+
+    def __init__(self, window, max_size, flush):
+        self.window = window
+        self.max_size = max_size
+        self.flush = flush
+        self._pending = {}  # key -> (items, timer handle)
+        self._tasks = set()
+
+    def add(self, key, item):
+        items, timer = self._pending.pop(key, ([], None))
+        if timer is not None:
+            timer.cancel()
+        items.append(item)
+        if self.window <= 0 or len(items) >= self.max_size:
+            self._run(key, items)
+            return
+        timer = asyncio.get_running_loop().call_later(self.window, self._expire, key)
+        self._pending[key] = (items, timer)
+
+    async def flush_all(self):
+        """Flush every pending batch now and wait for all flushes."""
+        for key, (items, timer) in list(self._pending.items()):
+            timer.cancel()
+            del self._pending[key]
+            self._run(key, items)
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def _expire(self, key):
+        items, _ = self._pending.pop(key)
+        self._run(key, items)
+
+    def _run(self, key, items):
+        task = asyncio.ensure_future(self.flush(key, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Batch flush failed", exc_info=task.exception())
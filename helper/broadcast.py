@@ -0,0 +1,139 @@
+import asyncio
+import datetime
+import logging
+import time
+import uuid
+from pyrogram.errors import FloodWait, InputUserDeactivated, UserIsBlocked, PeerIdInvalid
+from config import Config
+from .database import madflixbotz
+from .metrics import floodwait
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Shared by every broadcast so two admins broadcasting at once still stay
+# under Telegram's global bot limit.
+broadcast_bucket = TokenBucket(Config.BROADCAST_RATE)
+
+
+class Broadcast:
+    """Copies one message to every user, checkpointing progress in Mongo.
+
+    Users are walked in `_id` order in batches; a batch is sent by a bounded
+    pool of senders and its last `_id` is saved once it finishes, so a
+    restarted broadcast repeats at most one batch. Users who blocked the bot
+    or deleted their account are removed with one `delete_many` per batch.
+    """
+
+    def __init__(self, bot, state):
+        self.bot = bot
+        self.state = state
+        self.flood_waits = 0
+        self.flood_seconds = 0
+
+    @classmethod
+    async def start(cls, bot, message, status_msg):
+        state = {
+            # Per run: broadcasting the same message again while the first
+            # run is going must not overwrite its checkpoint
+            '_id': f"{message.chat.id}:{message.id}:{uuid.uuid4().hex[:8]}",
+            'status': 'running',
+            'from_chat_id': message.chat.id,
+            'message_id': message.id,
+            'status_chat_id': status_msg.chat.id,
+            'status_message_id': status_msg.id,
+            'last_user_id': None,
+            'total': await madflixbotz.total_users_count(),
+            'done': 0,
+            'success': 0,
+            'failed': 0,
+            'started_at': time.time(),
+        }
+        await madflixbotz.save_broadcast(state)
+        return cls(bot, state)
+
+    async def send(self, user_id):
+        for _ in range(Config.BROADCAST_RETRIES):
+            await broadcast_bucket.acquire()
+            try:
+                await self.bot.copy_message(user_id, self.state['from_chat_id'], self.state['message_id'])
+                return 200
+            except FloodWait as e:
+                self.flood_waits += 1
+                self.flood_seconds += e.value
+                floodwait(e.value, "broadcast")
+                broadcast_bucket.pause(e.value)
+            except InputUserDeactivated:
+                logger.info(f"{user_id} : Deactivated")
+                return 400
+            except UserIsBlocked:
+                logger.info(f"{user_id} : Blocked The Bot")
+                return 400
+            except PeerIdInvalid:
+                logger.info(f"{user_id} : User ID Invalid")
+                return 400
+            except Exception as e:
+                logger.error(f"{user_id} : {e}")
+                return 500
+        return 500
+
+    async def run(self):
+        state = self.state
+        workers = asyncio.Semaphore(Config.BROADCAST_WORKERS)
+        last_edit = 0
+
+        async def send(user_id):
+            async with workers:
+                return await self.send(user_id)
+
+        while True:
+            user_ids = await madflixbotz.get_user_ids(after=state['last_user_id'], limit=Config.BROADCAST_BATCH)
+            if not user_ids:
+                break
+            results = await asyncio.gather(*(send(user_id) for user_id in user_ids))
+            await madflixbotz.delete_users([u for u, sts in zip(user_ids, results) if sts == 400])
+
+            state['done'] += len(results)
+            state['success'] += results.count(200)
+            state['failed'] += len(results) - results.count(200)
+            state['last_user_id'] = user_ids[-1]
+            await madflixbotz.save_broadcast(state)
+
+            if time.time() - last_edit > 10:
+                last_edit = time.time()
+                await self.report("Broadcast In Progress")
+
+        state['status'] = 'done'
+        await madflixbotz.save_broadcast(state)
+        await self.report("Bʀᴏᴀᴅᴄᴀꜱᴛ Cᴏᴍᴩʟᴇᴛᴇᴅ")
+
+    async def report(self, title):
+        state = self.state
+        elapsed = datetime.timedelta(seconds=int(time.time() - state['started_at']))
+        text = (
+            f"{title}: \n\nTotal Users {state['total']}\n"
+            f"Completed : {state['done']} / {state['total']}\n"
+            f"Success : {state['success']}\nFailed : {state['failed']}\n"
+            f"Elapsed : `{elapsed}`\nFloodWaits : {self.flood_waits} ({self.flood_seconds}s)"
+        )
+        try:
+            await self.bot.edit_message_text(state['status_chat_id'], state['status_message_id'], text)
+        except Exception as e:
+            logger.error(f"Broadcast status update failed : {e}")
+
+
+_tasks = set()
+
+
+def run_in_background(broadcast):
+    task = asyncio.create_task(broadcast.run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def resume_broadcasts(bot):
+    """Pick up broadcasts that were still running when the bot stopped."""
+    for state in await madflixbotz.get_running_broadcasts():
+        logger.info(f"Resuming broadcast {state['_id']} after user {state['last_user_id']}")
+        run_in_background(Broadcast(bot, state))
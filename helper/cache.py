@@ -0,0 +1,126 @@
+import heapq
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries also expire after `ttl` seconds.
+
+    Not thread-safe; it is only touched from the bot's event loop.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def peek(self, key, default=None):
+        """Like `get` but leaves the LRU order and hit counters alone."""
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return default
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class DedupIndex:
+    """Keys of jobs that are running or finished less than `ttl` seconds ago.
+
+    `claim` is the only lookup: it returns False for a key that is already
+    there (a duplicate) and otherwise records it as running. Running keys
+    stay for at most `max_age` seconds, in case a job never calls `finish`.
+    Expiry is driven by a heap of deadlines, so it never scans the index,
+    and at most `maxsize` keys are kept (the soonest to expire go first).
+    """
+
+    def __init__(self, maxsize, ttl, max_age):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._expires = {}  # key -> deadline
+        self._heap = []  # (deadline, key); entries whose deadline moved are stale
+
+    def __len__(self):
+        return len(self._expires)
+
+    def __contains__(self, key):
+        self._expire(time.monotonic())
+        return key in self._expires
+
+    def _set(self, key, deadline):
+        self._expires[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        if len(self._heap) > 2 * len(self._expires) + 64:
+            # too many stale entries; rebuild from the live ones
+            self._heap = [(deadline, key) for key, deadline in self._expires.items()]
+            heapq.heapify(self._heap)
+
+    def _expire(self, now):
+        heap, expires = self._heap, self._expires
+        while heap and (heap[0][0] <= now or len(expires) > self.maxsize):
+            deadline, key = heapq.heappop(heap)
+            if expires.get(key) == deadline:
+                del expires[key]
+
+    def claim(self, key):
+        now = time.monotonic()
+        self._expire(now)
+        if key in self._expires:
+            self.hits += 1
+            return False
+        self.misses += 1
+        self._set(key, now + self.max_age)
+        self._expire(now)
+        return True
+
+    def finish(self, key):
+        """The job is over; still treat the key as a duplicate for `ttl`."""
+        if key in self._expires:
+            self._set(key, time.monotonic() + self.ttl)
+
+    def discard(self, key):
+        self._expires.pop(key, None)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -1,13 +1,67 @@
+import datetime
+import logging
 import motor.motor_asyncio
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from config import Config
+from .cache import TTLCache
+from .metrics import CACHES, MONGO_SECONDS
+from .shards import worker_index
 from .utils import send_log
 
+logger = logging.getLogger(__name__)
+
+# Settings attribute -> field in the user document
+SETTINGS_FIELDS = {
+    'thumbnail': 'file_id',
+    'caption': 'caption',
+    'format_template': 'format_template',
+    'format_compiled': 'format_compiled',
+    'media_type': 'media_type',
+}
+
+
+class UserSettings:
+    """The per-user settings one rename needs, read in a single query."""
+    __slots__ = tuple(SETTINGS_FIELDS)
+
+    def __init__(self, thumbnail=None, caption=None, format_template=None, format_compiled=None, media_type=None):
+        self.thumbnail = thumbnail
+        self.caption = caption
+        self.format_template = format_template
+        self.format_compiled = format_compiled
+        self.media_type = media_type
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"UserSettings({fields})"
+
+
 class Database:
 
     def __init__(self, uri, database_name):
-        self._client = motor.motor_asyncio.AsyncIOMotorClient(uri)
+        # Every handler shares this pool; fail fast instead of hanging a
+        # rename when Mongo is unreachable
+        self._client = motor.motor_asyncio.AsyncIOMotorClient(
+            uri,
+            maxPoolSize=Config.DB_MAX_POOL_SIZE,
+            minPoolSize=Config.DB_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=int(Config.DB_SELECT_TIMEOUT * 1000),
+            connectTimeoutMS=int(Config.DB_CONNECT_TIMEOUT * 1000),
+            socketTimeoutMS=int(Config.DB_SOCKET_TIMEOUT * 1000) or None,
+        )
         self.madflixbotz = self._client[database_name]
         self.col = self.madflixbotz.user
+        self.broadcasts = self.madflixbotz.broadcasts
+        self.results = self.madflixbotz.rename_results
+        self.jobs = self.madflixbotz.jobs
+        # Whole user documents, so one upload costs at most one find_one.
+        # Settings commands only write through the front process's cache, so
+        # rename workers read every batch's settings fresh instead
+        if worker_index is None:
+            self.user_cache = TTLCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
+        else:
+            self.user_cache = TTLCache(0, 0)
 
     def new_user(self, id):
         return dict(
@@ -17,19 +71,70 @@ class Database:
             format_template=None  # Add this line for the format template
         )
 
+    async def get_user(self, id):
+        user = self.user_cache.get(int(id))
+        if user is None or not all(field in user for field in SETTINGS_FIELDS.values()):
+            with MONGO_SECONDS.time(op='find_one'):
+                user = await self.col.find_one({'_id': int(id)})
+            if user is not None:
+                for field in SETTINGS_FIELDS.values():
+                    user.setdefault(field, None)
+                self.user_cache.set(int(id), user)
+        return user
+
+    async def get_user_settings(self, id, fields=None):
+        """Return a UserSettings with `fields` (names from SETTINGS_FIELDS,
+        default all) loaded in at most one projected find_one.
+
+        Fields already cached are not fetched again; the ones that are get
+        merged into the cached document.
+        """
+        fields = tuple(fields or SETTINGS_FIELDS)
+        db_fields = [SETTINGS_FIELDS[name] for name in fields]
+        user = self.user_cache.get(int(id))
+        missing = [field for field in db_fields if user is None or field not in user]
+        if missing:
+            with MONGO_SECONDS.time(op='find_one'):
+                doc = await self.col.find_one({'_id': int(id)}, {field: 1 for field in missing})
+            if doc is None:
+                return UserSettings()
+            if user is None:
+                user = {'_id': int(id)}
+                self.user_cache.set(int(id), user)
+            for field in missing:
+                user[field] = doc.get(field)
+        return UserSettings(**{name: user[field] for name, field in zip(fields, db_fields)})
+
+    async def update_user_settings(self, id, **settings):
+        """Save several settings (names from SETTINGS_FIELDS) in one update_one."""
+        fields = {SETTINGS_FIELDS[name]: value for name, value in settings.items()}
+        with MONGO_SECONDS.time(op='update_one'):
+            await self.col.update_one({'_id': int(id)}, {'$set': fields})
+        self._update_cached_user(id, **fields)
+
+    def _update_cached_user(self, id, **fields):
+        # Write-through: keep a cached document in step with what we just saved
+        user = self.user_cache.peek(int(id))
+        if user is not None:
+            user.update(fields)
+
     async def add_user(self, b, m):
         u = m.from_user
         if not await self.is_user_exist(u.id):
             user = self.new_user(u.id)
-            await self.col.insert_one(user)            
+            with MONGO_SECONDS.time(op='insert_one'):
+                await self.col.insert_one(user)            
+            self.user_cache.set(user['_id'], user)
             await send_log(b, u)
 
     async def is_user_exist(self, id):
-        user = await self.col.find_one({'_id': int(id)})
+        user = await self.get_user(id)
         return bool(user)
 
     async def total_users_count(self):
-        count = await self.col.count_documents({})
+        # From the collection metadata rather than a scan of every user
+        with MONGO_SECONDS.time(op='estimated_document_count'):
+            count = await self.col.estimated_document_count()
         return count
 
     async def get_all_users(self):
@@ -37,39 +142,168 @@ class Database:
         return all_users
 
     async def delete_user(self, user_id):
-        await self.col.delete_many({'_id': int(user_id)})
+        with MONGO_SECONDS.time(op='delete_many'):
+            await self.col.delete_many({'_id': int(user_id)})
+        self.user_cache.pop(int(user_id))
+
+    async def delete_users(self, user_ids):
+        if not user_ids:
+            return
+        with MONGO_SECONDS.time(op='delete_many'):
+            await self.col.delete_many({'_id': {'$in': [int(user_id) for user_id in user_ids]}})
+        for user_id in user_ids:
+            self.user_cache.pop(int(user_id))
+
+    async def get_user_ids(self, after=None, limit=500):
+        # Walks the _id index in order, so a broadcast can continue from
+        # the last id it finished
+        query = {} if after is None else {'_id': {'$gt': after}}
+        cursor = self.col.find(query, {'_id': 1}).sort('_id', 1).limit(limit)
+        with MONGO_SECONDS.time(op='find'):
+            return [user['_id'] async for user in cursor]
+
+    async def save_broadcast(self, state):
+        with MONGO_SECONDS.time(op='replace_one'):
+            await self.broadcasts.replace_one({'_id': state['_id']}, state, upsert=True)
+
+    async def get_running_broadcasts(self):
+        return [state async for state in self.broadcasts.find({'status': 'running'})]
+
+    async def ensure_indexes(self):
+        """Create the indexes the bot's queries rely on; run once at startup.
+        Users are only looked up by _id, which Mongo always indexes."""
+        try:
+            # Broadcasts to resume after a restart
+            await self.broadcasts.create_index('status')
+        except Exception as e:
+            logger.warning(f"Could not create the broadcast index: {e}")
+        if Config.RESULT_CACHE:
+            await self.create_result_index(Config.RESULT_CACHE_TTL)
+        if Config.JOB_QUEUE:
+            await self.create_job_indexes(Config.JOB_RETENTION)
+
+    async def create_result_index(self, ttl):
+        # Mongo drops result documents on its own once they are `ttl` old
+        try:
+            await self.results.create_index('created_at', expireAfterSeconds=int(ttl))
+        except Exception as e:
+            logger.warning(f"Could not create the rename result TTL index: {e}")
+
+    async def get_rename_result(self, key):
+        with MONGO_SECONDS.time(op='find_one'):
+            return await self.results.find_one({'_id': key})
+
+    async def save_rename_result(self, key, file_id, duration):
+        doc = {'file_id': file_id, 'duration': duration, 'created_at': datetime.datetime.now(datetime.timezone.utc)}
+        with MONGO_SECONDS.time(op='replace_one'):
+            await self.results.replace_one({'_id': key}, doc, upsert=True)
+
+    async def delete_rename_result(self, key):
+        await self.results.delete_one({'_id': key})
+
+    async def purge_rename_results(self):
+        result = await self.results.delete_many({})
+        return result.deleted_count
     
+    async def create_job_indexes(self, retention):
+        try:
+            # One live job per user and file across every worker
+            await self.jobs.create_index(
+                [('user_id', 1), ('file_unique_id', 1)], unique=True,
+                partialFilterExpression={'active': True},
+            )
+            await self.jobs.create_index([('active', 1), ('shard', 1), ('lease_until', 1)])
+            await self.jobs.create_index('finished_at', expireAfterSeconds=int(retention))
+        except Exception as e:
+            logger.warning(f"Could not create the job indexes: {e}")
+
+    async def insert_job(self, job):
+        """Insert a new job document; returns False when the same file is
+        already queued or running somewhere."""
+        try:
+            with MONGO_SECONDS.time(op='insert_one'):
+                await self.jobs.insert_one(job)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def update_job(self, job_id, owner, fields, unset=()):
+        # Only the current owner may move a job on; a worker that lost its
+        # lease must not overwrite the one that took over
+        update = {'$set': fields}
+        if unset:
+            update['$unset'] = {field: '' for field in unset}
+        with MONGO_SECONDS.time(op='update_one'):
+            result = await self.jobs.update_one({'_id': job_id, 'owner': owner}, update)
+        return result.modified_count == 1
+
+    async def renew_job_leases(self, job_ids, owner, lease_until):
+        with MONGO_SECONDS.time(op='update_many'):
+            await self.jobs.update_many(
+                {'_id': {'$in': list(job_ids)}, 'owner': owner, 'active': True},
+                {'$set': {'lease_until': lease_until}},
+            )
+
+    async def release_jobs(self, job_ids, owner, now):
+        # Handed over rather than abandoned, so it doesn't count as an attempt
+        with MONGO_SECONDS.time(op='update_many'):
+            await self.jobs.update_many(
+                {'_id': {'$in': list(job_ids)}, 'owner': owner, 'active': True},
+                {'$set': {'lease_until': now, 'state': 'queued'}, '$inc': {'attempts': -1}},
+            )
+
+    async def claim_job(self, owner, lease_until, now, shard=None):
+        """Take the oldest live job whose lease ran out, or None. A sharded
+        worker only takes its own shard's jobs (and unsharded ones)."""
+        query = {'active': True, 'lease_until': {'$lt': now}}
+        if shard is not None:
+            query['shard'] = {'$in': [shard, None]}
+        with MONGO_SECONDS.time(op='find_one_and_update'):
+            return await self.jobs.find_one_and_update(
+                query,
+                {'$set': {'owner': owner, 'lease_until': lease_until, 'state': 'queued'}, '$inc': {'attempts': 1}},
+                sort=[('created_at', 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+
+    async def count_jobs_by_state(self):
+        pipeline = [{'$match': {'active': True}}, {'$group': {'_id': '$state', 'count': {'$sum': 1}}}]
+        with MONGO_SECONDS.time(op='aggregate'):
+            return {doc['_id']: doc['count'] async for doc in self.jobs.aggregate(pipeline)}
+
     async def set_thumbnail(self, id, file_id):
-        await self.col.update_one({'_id': int(id)}, {'$set': {'file_id': file_id}})
+        await self.update_user_settings(id, thumbnail=file_id)
 
     async def get_thumbnail(self, id):
-        user = await self.col.find_one({'_id': int(id)})
-        return user.get('file_id', None)
+        user = await self.get_user(id)
+        return user.get('file_id', None) if user else None
 
     async def set_caption(self, id, caption):
-        await self.col.update_one({'_id': int(id)}, {'$set': {'caption': caption}})
+        await self.update_user_settings(id, caption=caption)
 
     async def get_caption(self, id):
-        user = await self.col.find_one({'_id': int(id)})
-        return user.get('caption', None)
+        user = await self.get_user(id)
+        return user.get('caption', None) if user else None
 
     async def set_format_template(self, id, format_template):
-        await self.col.update_one({'_id': int(id)}, {'$set': {'format_template': format_template}})
+        # A stale compiled form would win over the new template
+        await self.update_user_settings(id, format_template=format_template, format_compiled=None)
 
     async def get_format_template(self, id):
-        user = await self.col.find_one({'_id': int(id)})
-        return user.get('format_template', None)
+        user = await self.get_user(id)
+        return user.get('format_template', None) if user else None
         
     async def set_media_preference(self, id, media_type):
-        await self.col.update_one({'_id': int(id)}, {'$set': {'media_type': media_type}})
+        await self.update_user_settings(id, media_type=media_type)
         
     async def get_media_preference(self, id):
-        user = await self.col.find_one({'_id': int(id)})
-        return user.get('media_type', None)
+        user = await self.get_user(id)
+        return user.get('media_type', None) if user else None
 
 
 
 madflixbotz = Database(Config.DB_URL, Config.DB_NAME)
+CACHES.register("user", madflixbotz.user_cache)
         
 
 
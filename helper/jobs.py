@@ -0,0 +1,222 @@
+"""Rename jobs recorded in Mongo, so they outlive the process running them.
+
+Every incoming file gets a document in the `jobs` collection:
+
+    queued -> downloading -> uploading -> done | failed
+
+A live job belongs to one worker (`owner`) for as long as its lease runs;
+each worker renews the leases of the jobs it holds every
+JOB_HEARTBEAT_INTERVAL seconds. When a worker dies or restarts, its leases
+run out and any worker sharing the same DB_URL claims the jobs again and
+renames them from the start, up to JOB_MAX_ATTEMPTS times.
+
+Locally, jobs are looked up by the same (user_id, file_unique_id) key the
+duplicate index uses, so the rename code only passes that key around. A
+local job whose message nothing references any more was dropped by the
+rename code without an update; it is failed rather than renewed.
+
+In sharded mode (helper/shards.py) a job also carries the shard it belongs
+to, and each worker only claims jobs of its own shard.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import uuid
+import weakref
+from config import Config
+from .database import madflixbotz
+from .metrics import Counter, Gauge
+from .shards import worker_index
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATES = ("queued", "downloading", "uploading")
+RECOVERED = Counter("renamer_jobs_recovered_total", "Jobs claimed again after their worker's lease ran out")
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class JobQueue:
+
+    def __init__(self, enabled, lease, heartbeat, max_attempts, max_local, shard=None):
+        self.enabled = enabled
+        self.shard = shard
+        self.max_local = max_local
+        self.lease = lease
+        self.heartbeat = heartbeat
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.local = {}  # (user_id, file_unique_id) -> job _id
+        self._messages = {}  # same key -> weak reference to the job's message
+        self._resume = None
+        self._tasks = set()
+        self._wake = asyncio.Event()
+
+    def _lease_until(self):
+        return _now() + datetime.timedelta(seconds=self.lease)
+
+    def on_resume(self, func):
+        """Register `func(client, message, key)`, called with each job this
+        worker claims: one a dead worker left, or one the front queued for
+        its shard."""
+        self._resume = func
+        return func
+
+    async def enqueue(self, key, message, owned=True, shard=None, access_hash=None):
+        """Record a new job owned by this worker, or free for any worker (of
+        `shard`) to claim; returns False if the same file is already live
+        somewhere."""
+        if not self.enabled:
+            return True
+        job_id = uuid.uuid4().hex
+        now = _now()
+        job = {
+            '_id': job_id,
+            'user_id': key[0],
+            'file_unique_id': key[1],
+            'chat_id': message.chat.id,
+            'access_hash': access_hash,  # lets a worker with its own session reach the chat
+            'message_id': message.id,
+            'state': 'queued',
+            'active': True,
+            'owner': self.worker_id if owned else None,
+            'lease_until': self._lease_until() if owned else now,
+            'attempts': 1 if owned else 0,
+            'shard': shard,
+            'created_at': now,
+            'updated_at': now,
+        }
+        try:
+            if not await madflixbotz.insert_job(job):
+                return False
+        except Exception as e:
+            if not owned:
+                raise  # nobody would ever pick it up
+            # Without Mongo the rename still runs, it just isn't durable
+            logger.warning(f"Could not record job: {e}")
+            return True
+        if owned:
+            self._hold(key, job_id, message)
+        return True
+
+    def _hold(self, key, job_id, message):
+        # Every stage of the rename (batcher, scheduler queue, running
+        # task) keeps the message alive; once none does, the job is lost
+        self.local[key] = job_id
+        self._messages[key] = weakref.ref(message)
+
+    def _drop_lost(self):
+        """Fail the local jobs nothing works on any more, e.g. after an
+        unexpected error, instead of renewing their leases forever."""
+        for key in list(self.local):
+            ref = self._messages.get(key)
+            if ref is None or ref() is None:
+                logger.warning(f"Job {self.local[key]} was dropped without finishing")
+                self.update(key, 'failed', 'lost')
+
+    def update(self, key, state, error=None):
+        """Move a local job to `state`. Saved in the background so the
+        rename never waits on it; done and failed end the job."""
+        job_id = self.local.get(key)
+        if job_id is None:
+            return
+        fields = {'state': state, 'updated_at': _now()}
+        unset = ()
+        if state not in ACTIVE_STATES:
+            del self.local[key]
+            self._messages.pop(key, None)
+            fields['finished_at'] = fields['updated_at']
+            unset = ('active',)
+            if error:
+                fields['error'] = str(error)[:500]
+        task = asyncio.ensure_future(self._save(job_id, fields, unset))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _save(self, job_id, fields, unset):
+        try:
+            if not await madflixbotz.update_job(job_id, self.worker_id, fields, unset):
+                logger.warning(f"Job {job_id} now belongs to another worker")
+        except Exception as e:
+            logger.warning(f"Could not save job {job_id}: {e}")
+
+    async def flush(self):
+        """Wait for state updates still being saved."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def release(self):
+        """Give up the leases on every job this worker still holds, so the
+        next process (or another worker) claims them straight away."""
+        await self.flush()
+        held, self.local = self.local, {}
+        self._messages.clear()
+        if held:
+            try:
+                await madflixbotz.release_jobs(held.values(), self.worker_id, _now())
+            except Exception as e:
+                logger.warning(f"Could not release jobs: {e}")
+        return len(held)
+
+    def wake(self):
+        """Look for jobs to claim now rather than at the next heartbeat."""
+        self._wake.set()
+
+    async def run(self, client, has_capacity):
+        """Renew this worker's leases and pick up jobs other workers left
+        behind, while `has_capacity()` says there is room for them.
+
+        A claimed job waits in the batcher before the scheduler sees it, so
+        the jobs this worker already holds count too: it stops claiming at
+        `max_local`, leaving the rest to other workers."""
+        while True:
+            try:
+                self._drop_lost()
+                if self.local:
+                    await madflixbotz.renew_job_leases(self.local.values(), self.worker_id, self._lease_until())
+                while self._resume is not None and has_capacity() and len(self.local) < self.max_local:
+                    job = await madflixbotz.claim_job(self.worker_id, self._lease_until(), _now(), self.shard)
+                    if job is None:
+                        break
+                    await self._recover(client, job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Job queue check failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.heartbeat)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _recover(self, client, job):
+        key = (job['user_id'], job['file_unique_id'])
+        self.local[key] = job['_id']  # held once its message is fetched
+        if job['attempts'] > 1:
+            RECOVERED.inc()
+        if job['attempts'] > self.max_attempts:
+            logger.warning(f"Giving up on job {job['_id']} after {self.max_attempts} attempts")
+            return self.update(key, 'failed', 'too many attempts')
+        try:
+            if job.get('access_hash'):
+                await client.storage.update_peers([(job['chat_id'], job['access_hash'], "user", None, None)])
+            message = await client.get_messages(job['chat_id'], job['message_id'])
+        except Exception as e:
+            return self.update(key, 'failed', e)
+        if message is None or message.empty or not (message.document or message.video or message.audio):
+            return self.update(key, 'failed', 'message is gone')
+        logger.info(f"Starting job {job['_id']} (attempt {job['attempts']})")
+        self._hold(key, job['_id'], message)
+        await self._resume(client, message, key)
+
+
+job_queue = JobQueue(
+    Config.JOB_QUEUE, Config.JOB_LEASE, Config.JOB_HEARTBEAT_INTERVAL, Config.JOB_MAX_ATTEMPTS,
+    Config.MAX_CONCURRENT_JOBS, shard=worker_index,
+)
+
+Gauge("renamer_jobs_owned", "Live jobs this worker holds a lease on", func=lambda: len(job_queue.local))
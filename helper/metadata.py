@@ -0,0 +1,114 @@
+"""Media metadata (duration, size, audio tracks) read off the event loop.
+
+hachoir is pure Python and can spend seconds walking a large MKV, so it runs
+in a worker pool with QUALITY_FASTEST, which stops after the container
+headers instead of scanning the whole file.
+
+Latency budget: the header read is expected to take well under 100 ms for
+MP4/MP3 and a few hundred ms for MKV (see benchmarks/bench_metadata.py).
+METADATA_TIMEOUT (default 10 s) is the hard cap. A file that hits it gets
+the fallback values (usually the duration Telegram already reported), and
+the stuck worker is replaced so it cannot hold a pool slot.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+EMPTY_METADATA = {"duration": 0, "width": 0, "height": 0, "audio_tracks": 0}
+
+
+def read_metadata(path):
+    """Parse just enough of `path` to fill EMPTY_METADATA's keys.
+
+    Runs inside the worker pool; returns a plain dict so it pickles cheaply.
+    """
+    # Imported here, so only pool workers pay for hachoir and startup doesn't
+    from hachoir.metadata import extractMetadata
+    from hachoir.metadata.metadata_item import QUALITY_FASTEST
+    from hachoir.parser import createParser
+
+    result = dict(EMPTY_METADATA)
+    parser = createParser(path)
+    if parser is None:
+        return result
+    with parser:
+        metadata = extractMetadata(parser, quality=QUALITY_FASTEST)
+    if metadata is None:
+        return result
+
+    # MKV/MP4 report per-stream groups, MP3 and friends a flat record
+    groups = list(metadata.iterGroups()) if hasattr(metadata, "iterGroups") else []
+    for item in [metadata] + groups:
+        if not result["duration"] and item.has("duration"):
+            result["duration"] = int(item.get("duration").total_seconds())
+        if not result["width"] and item.has("width") and item.has("height"):
+            result["width"] = item.get("width")
+            result["height"] = item.get("height")
+    result["audio_tracks"] = sum(1 for group in groups if getattr(group, "header", "").startswith("Audio"))
+    if not groups and parser.mime_type and parser.mime_type.startswith("audio/"):
+        result["audio_tracks"] = 1
+    return result
+
+
+def _new_pool():
+    if Config.METADATA_EXECUTOR == "thread":
+        return ThreadPoolExecutor(max_workers=Config.METADATA_WORKERS, thread_name_prefix="metadata")
+    # forkserver, not fork: by now the bot runs motor's and the executors'
+    # threads, and a forked child could inherit one of their locks held.
+    # Workers fork from a clean server that has hachoir loaded already.
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["helper.metadata", "hachoir.parser", "hachoir.metadata"])
+    return ProcessPoolExecutor(max_workers=Config.METADATA_WORKERS, mp_context=context)
+
+
+_pool = None
+
+
+def _reset_pool(pool):
+    """Replace `pool` after it timed out or broke. Jobs that were running
+    in it fail with BrokenExecutor too; their resets must not take down
+    the pool that replaced it."""
+    global _pool
+    if pool is None or pool is not _pool:
+        return
+    _pool = None
+    for process in list(getattr(pool, "_processes", {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def extract_metadata(path, fallback=None, timeout=None):
+    """Read `path`'s metadata in the worker pool without blocking the loop.
+
+    Returns a dict with EMPTY_METADATA's keys; values that could not be read
+    (error or timeout) come from `fallback`.
+    """
+    global _pool
+    result = dict(EMPTY_METADATA, **(fallback or {}))
+    if _pool is None:
+        _pool = _new_pool()
+    pool = _pool
+    loop = asyncio.get_running_loop()
+    try:
+        found = await asyncio.wait_for(
+            loop.run_in_executor(pool, read_metadata, path),
+            timeout or Config.METADATA_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Metadata extraction timed out for {path}")
+        _reset_pool(pool)
+        return result
+    except BrokenExecutor as e:
+        # A broken process pool refuses every later job; start fresh
+        logger.warning(f"Metadata pool broke on {path}: {e}")
+        _reset_pool(pool)
+        return result
+    except Exception as e:
+        logger.warning(f"Error getting metadata for {path}: {e}")
+        return result
+    result.update({key: value for key, value in found.items() if value})
+    return result
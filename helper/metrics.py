@@ -0,0 +1,193 @@
+"""Minimal Prometheus text-format metrics, served on the health server's
+/metrics route.
+
+Only what the bot needs: counters, gauges (optionally computed on scrape)
+and fixed-bucket histograms, each with optional labels.
+"""
+import asyncio
+import logging
+import re
+import time
+from contextlib import contextmanager
+
+_registry = []
+
+# Bucket sets reused by several histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+THROUGHPUT_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(-2, 8))  # 256 KiB/s .. 128 MiB/s
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        yield from super().render()
+        for key, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, key)} {value}"
+
+
+class Gauge(Counter):
+    """A value that goes up and down; pass `func` to compute it on scrape."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.func is not None:
+            try:
+                self._values[()] = self.func()
+            except Exception:
+                pass
+        yield from super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        data = self._values.get(key)
+        if data is None:
+            data = self._values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        yield from super().render()
+        for key, data in self._values.items():
+            names = self.labelnames + ("le",)
+            for bound, count in zip(self.buckets, data):
+                yield f"{self.name}_bucket{_labels(names, key + (repr(float(bound)),))} {count}"
+            yield f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {data[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {data[-2]}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {data[-1]}"
+
+
+class CacheStats(_Metric):
+    """Reads `hits` and `misses` off every registered cache at scrape time."""
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation, ("cache", "result"))
+        self._caches = {}
+
+    def register(self, name, cache):
+        self._caches[name] = cache
+
+    def render(self):
+        yield from super().render()
+        for name, cache in self._caches.items():
+            for result in ("hits", "misses"):
+                yield f"{self.name}{_labels(self.labelnames, (name, result))} {getattr(cache, result)}"
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- metrics shared across the bot ------------------------------------------
+
+JOBS = Counter("renamer_jobs_total", "Rename jobs by outcome", ["outcome"])
+RENAME_PATHS = Counter("renamer_rename_path_total", "Jobs that re-sent the file_id (fast) or downloaded and re-uploaded it (full)", ["path"])
+STAGE_SECONDS = Histogram("renamer_stage_seconds", "Time spent per rename stage", ["stage"])
+TRANSFER_BYTES = Counter("renamer_transfer_bytes_total", "Bytes downloaded and uploaded", ["direction"])
+TRANSFER_THROUGHPUT = Histogram("renamer_transfer_throughput_bytes_per_second", "Average speed of finished transfers", ["direction"], buckets=THROUGHPUT_BUCKETS)
+TRANSFER_RETRIES = Counter("renamer_transfer_retries_total", "Download chunks and upload parts that were retried", ["direction"])
+MONGO_SECONDS = Histogram("renamer_mongo_query_seconds", "MongoDB call latency", ["op"])
+FLOODWAITS = Counter("renamer_floodwait_total", "FloodWait errors received", ["source"])
+FLOODWAIT_SECONDS = Counter("renamer_floodwait_seconds_total", "Seconds slept because of FloodWait", ["source"])
+CACHES = CacheStats("renamer_cache_requests_total", "Cache lookups by cache and result")
+STARTUP_SECONDS = Gauge("renamer_startup_seconds", "Seconds from process start to each startup phase", ["phase"])
+LOOP_LAG = Histogram("renamer_event_loop_lag_seconds", "How late the event loop woke up a 1 s timer", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5))
+LOOP_LAG_LAST = Gauge("renamer_event_loop_lag_last_seconds", "Event loop lag at the last check")
+
+
+def floodwait(seconds, source):
+    FLOODWAITS.inc(source=source)
+    FLOODWAIT_SECONDS.inc(seconds, source=source)
+
+
+class _PyrogramFloodWaits(logging.Handler):
+    # pyrogram sleeps through short FloodWaits itself and only logs them
+    pattern = re.compile(r"Waiting for (\d+) seconds")
+
+    def emit(self, record):
+        match = self.pattern.search(record.getMessage())
+        if match:
+            floodwait(int(match.group(1)), "pyrogram")
+
+
+logging.getLogger("pyrogram.session.session").addHandler(_PyrogramFloodWaits())
+
+
+async def monitor_event_loop(interval=1.0):
+    """Record how late a sleeping task wakes up; run it as a background task."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG.observe(lag)
+        LOOP_LAG_LAST.set(lag)
@@ -0,0 +1,132 @@
+import re
+from collections import namedtuple
+
+# Everything the rename pipeline needs from a filename, pulled out in one scan.
+# `episode_pattern` names the legacy pattern that won, which helps when a
+# user reports a wrong episode number. `title` is whatever comes before the
+# first season/episode/quality token.
+ParsedName = namedtuple(
+    "ParsedName",
+    ["season", "episode", "quality", "codec", "group", "episode_pattern", "title"],
+)
+
+# One scanner over every pattern the old cascade used. Each branch consumes
+# only its first character and checks the rest with a lookahead, so the scan
+# still visits every position once and the regex engine can skip straight to
+# the few characters (S, E, -, digits, h, x, a) that can start a token.
+# Branches that share a first character are listed in the old priority
+# order, which makes the first hit per branch exactly what the old
+# per-pattern `re.search` calls returned.
+_SCANNER = re.compile(r"""
+    # --- episode, highest priority first ---
+      S(?=(?P<p1_s>\d+)(?:E|EP)(?P<p1_e>\d+))                       # S01E02 / S01EP02
+    | S(?=(?P<p2_s>\d+)\s*(?:E|EP|-\s*EP)(?P<p2_e>\d+))             # S01 E02 / S01 - EP02
+    | [Ss](?=(?P<p4_s>\d+)\D*(?P<p4_e>\d+))                         # S2 09
+    | [Ss](?=[Ee][Aa][Ss][Oo][Nn]\s*(?P<sn>\d+))                    # Season 2
+    | E(?=P?\s*(?P<p3_e>\d+))                                       # E02 / EP 02
+    | -(?=\s*(?P<p32_e>\d+))                                        # - 02
+    # --- quality, same priority as before ---
+    | \d(?=\d\d\d?[^\dpP]*[pP])(?P<q5>)                             # 1080p
+    | 4(?=[kK])(?P<q6>)
+    | 2(?=[kK])(?P<q7>)
+    | [hH](?=[dD][rR][iI][pP])(?P<q8>)
+    # --- codec ---
+    | [xXhHaA](?=(?P<codec>
+          (?<=[xXhH])\.?26[45]
+        | (?<=[hH])[eE][vV][cC]\b
+        | (?<=[aA])[vV][cC1]\b
+        | (?<=[xX])[vV][iI][dD]\b
+      ))
+""", re.VERBOSE)
+
+# Only run on the one position the scanner already picked.
+_QUALITY_AT = re.compile(r"\d{3,4}[^\dp]*p", re.IGNORECASE)
+_FIRST_NUMBER = re.compile(r"\d+")
+_SPACES = re.compile(r"\s+")
+
+# Scanner hit -> (priority, legacy pattern name, season group). The hit name
+# is also the group holding the episode number.
+_EPISODE_PATTERNS = {
+    "p1_e": (0, "1", "p1_s"),
+    "p2_e": (1, "2", "p2_s"),
+    "p3_e": (2, "3", None),
+    "p32_e": (3, "3_2", None),
+    "p4_e": (4, "4", "p4_s"),
+}
+# Scanner hit -> (priority, fixed label); q5 keeps the matched text.
+_QUALITY_PATTERNS = {"q5": (0, None), "q6": (1, "4k"), "q7": (2, "2k"), "q8": (3, "HdRip")}
+
+
+def parse_filename(filename):
+    """Extract season, episode, quality, codec and release group in one pass.
+
+    Episode and quality follow the same priority order as the old regex
+    cascade, so `episode` and `quality` match what `extract_episode_number`
+    and `extract_quality` always returned (`None` instead of "Unknown" when
+    no quality is found).
+    """
+    episode_hit = quality_hit = codec = season = first_token = None
+    episode_rank = quality_rank = len(_EPISODE_PATTERNS)
+    for match in _SCANNER.finditer(filename):
+        name = match.lastgroup
+        if first_token is None:
+            first_token = match.start()
+        if name in _EPISODE_PATTERNS:
+            rank = _EPISODE_PATTERNS[name][0]
+            if rank < episode_rank:
+                episode_rank, episode_hit = rank, match
+        elif name in _QUALITY_PATTERNS:
+            rank = _QUALITY_PATTERNS[name][0]
+            if rank < quality_rank:
+                quality_rank, quality_hit = rank, match
+        elif name == "codec":
+            if codec is None:
+                codec = filename[match.start():match.end("codec")]
+        elif season is None:
+            season = match.group("sn")
+        # Nothing later can change the result once the top episode and
+        # quality patterns and a codec have all been seen.
+        if not episode_rank and not quality_rank and codec is not None:
+            break
+
+    episode = episode_pattern = None
+    if episode_hit is not None:
+        name = episode_hit.lastgroup
+        _, episode_pattern, season_group = _EPISODE_PATTERNS[name]
+        episode = episode_hit.group(name)
+        if season_group:
+            season = episode_hit.group(season_group)
+    else:
+        # Pattern X: the first standalone number, only needed when nothing
+        # more specific matched.
+        match = _FIRST_NUMBER.search(filename)
+        if match:
+            episode, episode_pattern = match.group(), "X"
+            first_token = match.start()
+
+    quality = None
+    if quality_hit is not None:
+        quality = _QUALITY_PATTERNS[quality_hit.lastgroup][1]
+        if quality is None:
+            quality = _QUALITY_AT.match(filename, quality_hit.start()).group()
+
+    # Leading "[Group]" tag, or a scene-style "...x264-GROUP.mkv" suffix.
+    group = None
+    title_start = 0
+    stem = filename.rsplit(".", 1)[0] if "." in filename[-5:] else filename
+    if filename.startswith("["):
+        end = filename.find("]")
+        if end > 1:
+            group = filename[1:end]
+            title_start = end + 1
+    else:
+        head, dash, tail = stem.rpartition("-")
+        if dash and tail.isalnum() and not tail.isdigit():
+            group = tail
+
+    title = stem[title_start:first_token] if first_token is not None and first_token > title_start else stem[title_start:]
+    if " " not in title:
+        title = title.replace(".", " ").replace("_", " ")
+    title = _SPACES.sub(" ", title).strip(" -_.[(") or None
+
+    return ParsedName(season, episode, quality, codec, group, episode_pattern, title)
@@ -0,0 +1,61 @@
+"""Finished renames, remembered so a repeat only costs one re-send.
+
+Many users send the same popular file with the same template and
+thumbnail. The output is then byte-for-byte what we uploaded before, so
+its file_id can be sent again with send_cached_media instead of
+downloading and uploading it again. Entries live in Mongo and expire
+through a TTL index after RESULT_CACHE_TTL seconds.
+"""
+import hashlib
+import logging
+from .database import madflixbotz
+from .metrics import CACHES
+
+logger = logging.getLogger(__name__)
+
+
+class RenameResults:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(file_unique_id, new_file_name, thumb_id, media_type):
+        # Everything that ends up inside the uploaded file; the caption is
+        # sent alongside it, so it is not part of the key
+        raw = "\0".join((file_unique_id, new_file_name, thumb_id or "", media_type))
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    async def get(self, key):
+        """The cached output ({'file_id', 'duration'}) or None."""
+        try:
+            doc = await madflixbotz.get_rename_result(key)
+        except Exception as e:
+            logger.warning(f"Result cache lookup failed: {e}")
+            doc = None
+        if doc is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return doc
+
+    async def save(self, key, sent, duration):
+        media = sent and (sent.document or sent.video or sent.audio)
+        if media is None:
+            return
+        try:
+            await madflixbotz.save_rename_result(key, media.file_id, duration)
+        except Exception as e:
+            logger.warning(f"Could not save rename result: {e}")
+
+    async def forget(self, key):
+        # The stored file_id stopped working
+        try:
+            await madflixbotz.delete_rename_result(key)
+        except Exception as e:
+            logger.warning(f"Could not forget rename result: {e}")
+
+
+rename_results = RenameResults()
+CACHES.register("result", rename_results)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from config import Config
+from .metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+
+class JobScheduler:
+    """Queue for rename jobs with a global cap, a per-user cap and
+    round-robin fairness between users.
+
+    Jobs of one user run in the order they were sent; between users the
+    scheduler takes one job per user in turn, so a user dumping 50 files
+    only ever holds `per_user` of the `max_jobs` running slots. Downloads
+    and uploads get their own semaphores so a job waiting on an upload slot
+    does not hold a download slot and vice versa.
+    """
+
+    def __init__(self, max_jobs, per_user, download_slots, upload_slots):
+        self.max_jobs = max_jobs
+        self.per_user = per_user
+        self.download_slot = asyncio.Semaphore(download_slots)
+        self.upload_slot = asyncio.Semaphore(upload_slots)
+        self._queues = OrderedDict()  # user_id -> deque of job factories
+        self._running = {}            # user_id -> running job count
+        self._active = 0
+        self._tasks = set()
+        self.draining = False
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def queued(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, user_id, job):
+        """Queue `job` (a callable returning an awaitable) for `user_id`.
+
+        Returns the job's 1-based position in the queue (1 = next to
+        start), or 0 when it was started right away.
+        """
+        self._queues.setdefault(user_id, deque()).append(job)
+        position = self._position(user_id)
+        self._dispatch()
+        return position if self._queues.get(user_id) else 0
+
+    def _position(self, user_id):
+        # Each round-robin turn starts one job per waiting user, so the new
+        # job waits for its own backlog plus up to as many turns from every
+        # other user; it starts right after those.
+        own = len(self._queues[user_id])
+        ahead = own - 1
+        for other, queue in self._queues.items():
+            if other != user_id:
+                ahead += min(len(queue), own)
+        return ahead + 1
+
+    def drain(self):
+        """Stop starting queued jobs; running ones carry on."""
+        self.draining = True
+
+    @property
+    def has_capacity(self):
+        return not self.draining and self._active + self.queued < self.max_jobs
+
+    async def wait_idle(self, timeout, report=None, interval=5):
+        """Wait up to `timeout` seconds for running jobs to finish, calling
+        `report(active, queued, seconds_left)` every `interval` seconds.
+        Returns whether everything finished."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._active:
+            left = deadline - loop.time()
+            if left <= 0:
+                return False
+            if report:
+                await report(self._active, self.queued, left)
+            await asyncio.sleep(min(interval, left))
+        return True
+
+    def _dispatch(self):
+        while self._active < self.max_jobs and not self.draining:
+            for user_id, queue in self._queues.items():
+                if self._running.get(user_id, 0) < self.per_user:
+                    break
+            else:
+                return
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._active += 1
+            self._running[user_id] = self._running.get(user_id, 0) + 1
+            task = asyncio.create_task(self._run(user_id, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, user_id, job):
+        try:
+            await job()
+        except Exception:
+            logger.exception("Rename job for %s failed", user_id)
+        finally:
+            self._active -= 1
+            self._running[user_id] -= 1
+            if not self._running[user_id]:
+                del self._running[user_id]
+            self._dispatch()
+
+
+scheduler = JobScheduler(
+    max_jobs=Config.MAX_CONCURRENT_JOBS,
+    per_user=Config.MAX_JOBS_PER_USER,
+    download_slots=Config.DOWNLOAD_SLOTS,
+    upload_slots=Config.UPLOAD_SLOTS,
+)
+
+Gauge("renamer_jobs_active", "Rename jobs currently running", func=lambda: scheduler.active)
+Gauge("renamer_jobs_queued", "Rename jobs waiting for a slot", func=lambda: scheduler.queued)
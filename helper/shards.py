@@ -0,0 +1,138 @@
+"""Sharded worker mode: one front process, WORKER_PROCESSES rename workers.
+
+The front process receives every update and answers commands. Files are
+recorded in the job queue with `shard = shard_of(user_id)` and the worker
+for that shard is poked through its stdin, so it claims the job straight
+away instead of at its next poll. Each worker is the same bot.py started
+with RENAMER_WORKER set; it connects with its own session and no updates,
+and only downloads, encrypts and uploads, so every transfer's crypto runs
+on its own core.
+
+A worker that dies is started again; the jobs it held come back to it
+through their leases like after any crash.
+"""
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Which shard this process serves; None in the front or a single process
+worker_index = int(os.environ["RENAMER_WORKER"]) if os.environ.get("RENAMER_WORKER") else None
+
+
+def sharded():
+    return Config.WORKER_PROCESSES > 0 and Config.JOB_QUEUE
+
+
+def process_dir(path):
+    """This process's own subdirectory of a directory all processes share,
+    so one process's cleanup never deletes another's files."""
+    if worker_index is not None:
+        return os.path.join(path, f"worker{worker_index}")
+    if sharded():
+        return os.path.join(path, "front")
+    return path
+
+
+def process_share():
+    # Part of a shared resource (like disk quota) each process may use
+    return Config.WORKER_PROCESSES + 1 if sharded() else 1
+
+
+def shard_of(user_id, count):
+    # All of one user's files land on one worker, so per-user order,
+    # batching and the dedup index keep working
+    return int(user_id) % count
+
+
+class Supervisor:
+    """Starts the worker processes, restarts them when they exit, and
+    wakes them up when their shard has a new job."""
+
+    def __init__(self, count):
+        self.count = count
+        self.procs = [None] * count
+        self._watchers = []
+        self._stopping = False
+
+    async def start(self):
+        for index in range(self.count):
+            await self._spawn(index)
+            self._watchers.append(asyncio.create_task(self._watch(index)))
+        logger.info(f"Started {self.count} rename workers")
+
+    async def _spawn(self, index):
+        env = dict(os.environ, RENAMER_WORKER=str(index))
+        self.procs[index] = await asyncio.create_subprocess_exec(
+            sys.executable, *sys.argv, env=env, stdin=asyncio.subprocess.PIPE,
+        )
+
+    async def _watch(self, index):
+        backoff = 1
+        while True:
+            proc = self.procs[index]
+            started = time.monotonic()
+            code = await proc.wait()
+            if self._stopping:
+                return
+            if time.monotonic() - started > 60:
+                backoff = 1  # it was up for a while; not a crash loop
+            logger.warning(f"Rename worker {index} exited with {code}, restarting in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+            await self._spawn(index)
+
+    def notify(self, shard):
+        """Tell the worker for `shard` to look for jobs now."""
+        proc = self.procs[shard]
+        if proc is not None and proc.returncode is None:
+            try:
+                proc.stdin.write(b"\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    async def stop(self, timeout):
+        """SIGTERM every worker (each drains like a single bot would) and
+        wait up to `timeout` seconds before killing the rest."""
+        self._stopping = True
+        for watcher in self._watchers:
+            watcher.cancel()
+        running = [proc for proc in self.procs if proc is not None and proc.returncode is None]
+        for proc in running:
+            proc.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(proc.wait() for proc in running)), timeout)
+        except asyncio.TimeoutError:
+            for proc in running:
+                if proc.returncode is None:
+                    proc.kill()
+
+
+def listen_for_wakeups(job_queue):
+    """In a worker: wake `job_queue` on every line the front writes to our
+    stdin, and shut down cleanly if the front goes away."""
+    loop = asyncio.get_running_loop()
+    fd = sys.stdin.fileno()
+
+    def on_input():
+        if os.read(fd, 4096):
+            job_queue.wake()
+        else:
+            loop.remove_reader(fd)
+            logger.warning("Front process is gone, stopping")
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    loop.add_reader(fd, on_input)
+
+
+supervisor = None
+if worker_index is None and Config.WORKER_PROCESSES > 0:
+    if sharded():
+        supervisor = Supervisor(Config.WORKER_PROCESSES)
+    else:
+        logger.warning("WORKER_PROCESSES needs JOB_QUEUE, running as a single process")
@@ -0,0 +1,45 @@
+"""Draining the bot before it stops or restarts.
+
+New files are handed to the job queue instead of started, running renames
+get a deadline to finish, and whatever is still live after that has its
+lease released so the next process picks it up at once rather than after
+JOB_LEASE seconds.
+"""
+import logging
+from .jobs import job_queue
+from .scheduler import scheduler
+from .tracing import trace_logger
+
+logger = logging.getLogger(__name__)
+
+_hooks = []
+_drained = None
+
+
+def on_drain(func):
+    """Register an async `func()` run as soon as draining starts, e.g. to
+    flush batches still collecting files."""
+    _hooks.append(func)
+    return func
+
+
+async def drain(timeout, report=None):
+    """Stop starting jobs and wait up to `timeout` seconds for running ones,
+    passing `report` on to scheduler.wait_idle. Returns (finished, number
+    of jobs handed over); a second call returns the first call's result."""
+    global _drained
+    if _drained is not None:
+        return _drained
+    scheduler.drain()
+    for hook in _hooks:
+        try:
+            await hook()
+        except Exception:
+            logger.exception("Drain hook failed")
+    finished = await scheduler.wait_idle(timeout, report)
+    released = await job_queue.release()
+    for handler in logging.getLogger().handlers + trace_logger.handlers:
+        handler.flush()
+    logger.info(f"Drained: {'all jobs finished' if finished else 'deadline passed'}, {released} jobs handed over")
+    _drained = (finished, released)
+    return _drained
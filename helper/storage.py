@@ -0,0 +1,174 @@
+"""Scratch space for downloads, with a byte quota.
+
+Each job reserves its file size before downloading and gets its own
+directory. The reservation waits (FIFO) while the quota is used up, and
+releasing it deletes the directory. A job that fails anywhere between
+download and upload therefore leaves nothing behind. Directories that do
+not belong to a live job are orphans from a crash and are removed at
+startup and periodically after that.
+
+Files up to SCRATCH_SMALL_MAX_MB can go to a second, faster directory such
+as a tmpfs (SCRATCH_SMALL_DIR) with its own quota.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import deque
+from config import Config
+from .metrics import Gauge
+from .shards import process_dir, process_share
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class ScratchSpace:
+    """One scratch directory and the bytes reserved in it."""
+
+    def __init__(self, path, quota, share=1):
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.used = 0
+        self._active = set()  # directory names of live reservations
+        self._waiters = deque()  # (size, future), oldest first
+        self._quota = quota
+        self._share = share
+        self.quota = self._measure_quota()
+
+    def _measure_quota(self):
+        # 0 means "most of what the disk has free right now"; processes
+        # sharing the directory split it
+        return (self._quota or int(shutil.disk_usage(self.path).free * 0.9)) // self._share
+
+    def start(self):
+        """Remove what a previous run left behind and size the quota on what
+        is free after that. Called once the bot starts, never on import, as
+        other processes (and benchmarks) import this module too."""
+        self.cleanup()
+        self.quota = self._measure_quota()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def _fits(self, size):
+        # A file bigger than the whole quota still gets to run, alone
+        return self.used == 0 or self.used + size <= self.quota
+
+    def _grant(self):
+        while self._waiters:
+            size, future = self._waiters[0]
+            if future.done():  # cancelled while waiting
+                self._waiters.popleft()
+                continue
+            if not self._fits(size):
+                break
+            self._waiters.popleft()
+            self.used += size
+            future.set_result(None)
+
+    def reserve(self, size):
+        return Reservation(self, size or 0)
+
+    def cleanup(self, max_age=0):
+        """Delete everything in the directory that no live job owns and that
+        was last modified more than `max_age` seconds ago."""
+        now = time.time()
+        removed = 0
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name in self._active:
+                    continue
+                try:
+                    if now - entry.stat(follow_symlinks=False).st_mtime < max_age:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"Could not remove orphan {entry.path}: {e}")
+        if removed:
+            logger.info(f"Removed {removed} orphaned entries from {self.path}")
+
+
+class Reservation:
+    """`size` bytes of a ScratchSpace plus a private directory.
+
+    Queued as soon as it is created; `ready` tells whether `acquire()` will
+    have to wait. `release()` is safe to call at any point, more than once.
+    """
+
+    def __init__(self, space, size):
+        self.space = space
+        self.size = size
+        self.name = uuid.uuid4().hex
+        self.dir = os.path.join(space.path, self.name)
+        self._future = asyncio.get_running_loop().create_future()
+        self._released = False
+        space._active.add(self.name)
+        space._waiters.append((size, self._future))
+        space._grant()
+
+    @property
+    def ready(self):
+        return self._future.done()
+
+    async def acquire(self):
+        await asyncio.shield(self._future)
+        os.makedirs(self.dir, exist_ok=True)
+        return self
+
+    def file(self, name):
+        return os.path.join(self.dir, name)
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        space = self.space
+        if self._future.done():
+            space.used -= self.size
+        else:
+            self._future.cancel()
+        shutil.rmtree(self.dir, ignore_errors=True)
+        space._active.discard(self.name)
+        space._grant()
+
+
+scratch = ScratchSpace(process_dir(Config.SCRATCH_DIR), Config.SCRATCH_QUOTA_MB * MB, process_share())
+small_scratch = ScratchSpace(process_dir(Config.SCRATCH_SMALL_DIR), Config.SCRATCH_SMALL_QUOTA_MB * MB, process_share()) if Config.SCRATCH_SMALL_DIR else None
+
+Gauge("renamer_scratch_reserved_bytes", "Bytes reserved in the scratch directory", func=lambda: scratch.used)
+Gauge("renamer_scratch_waiting_jobs", "Jobs waiting for scratch space", func=lambda: scratch.waiting)
+
+
+def reserve_scratch(size):
+    """Queue a reservation for a download of `size` bytes."""
+    if small_scratch is not None and size and size <= Config.SCRATCH_SMALL_MAX_MB * MB:
+        return small_scratch.reserve(size)
+    return scratch.reserve(size)
+
+
+def start_scratch():
+    """Clear leftovers of the last run; Bot.start calls this once."""
+    for space in (scratch, small_scratch):
+        if space is not None:
+            space.start()
+
+
+async def cleanup_orphans():
+    """Background task: periodically drop scratch files no job owns."""
+    while True:
+        await asyncio.sleep(Config.SCRATCH_CLEANUP_INTERVAL)
+        for space in (scratch, small_scratch):
+            if space is not None:
+                try:
+                    space.cleanup(max_age=Config.SCRATCH_CLEANUP_INTERVAL)
+                except Exception as e:
+                    logger.warning(f"Scratch cleanup failed: {e}")
@@ -0,0 +1,127 @@
+"""Auto rename format templates, compiled once when the user sets them.
+
+A template with braces uses explicit tokens:
+
+    {title} S{season:02}E{episode:02} [{quality}].{ext}
+
+Tokens are the ParsedName fields (season, episode, quality, title, codec,
+group) plus ext, the original extension without its dot. `:NN` zero-pads
+a number to NN digits, and `{{` / `}}` are literal braces. When `{ext}` is
+not used, the original extension is appended as before.
+
+A template without braces keeps the old meaning: the first "episode",
+"Episode" and "EPISODE" become the episode number, and every "quality"
+variant becomes the quality.
+
+The compiled form is a list of literal strings and [token, width] pairs.
+It is stored next to the raw template, so an upload only runs
+`render_template`.
+"""
+import re
+
+TOKENS = ("season", "episode", "quality", "title", "codec", "group", "ext")
+NUMERIC_TOKENS = ("season", "episode")
+
+_BRACE_TOKEN = re.compile(r"\{\{|\}\}|\{([^{}:]*)(?::([^{}]*))?\}|[{}]")
+_LEGACY_EPISODE = ("episode", "Episode", "EPISODE")
+_LEGACY_QUALITY = re.compile(r"quality|Quality|QUALITY")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def _compile_braces(raw):
+    parts = []
+    literal = []
+    pos = 0
+    for match in _BRACE_TOKEN.finditer(raw):
+        literal.append(raw[pos:match.start()])
+        pos = match.end()
+        text = match.group()
+        if text in ("{{", "}}"):
+            literal.append(text[0])
+            continue
+        if text in ("{", "}"):
+            raise TemplateError(f"Unmatched '{text}' at position {match.start() + 1}")
+        name = match.group(1).strip().lower()
+        if name not in TOKENS:
+            raise TemplateError(f"Unknown token {{{match.group(1)}}}. Use one of: " + ", ".join(f"{{{t}}}" for t in TOKENS))
+        width = 0
+        spec = match.group(2)
+        if spec is not None:
+            if name not in NUMERIC_TOKENS or not spec.isdigit():
+                raise TemplateError(f"Bad format {{{match.group(1)}:{spec}}}; only {{season}} and {{episode}} take a width like :02")
+            width = int(spec)
+        _flush_literal(parts, literal)
+        parts.append([name, width])
+    literal.append(raw[pos:])
+    _flush_literal(parts, literal)
+    return parts
+
+
+def _flush_literal(parts, literal):
+    # Text between two tokens, if there is any; an empty string would only
+    # be one more part to skip at render time
+    text = "".join(literal)
+    if text:
+        parts.append(text)
+    literal.clear()
+
+
+def _compile_legacy(raw):
+    # Token positions the old str.replace loop would have hit: the first of
+    # each episode spelling and every quality spelling
+    spans = []
+    for word in _LEGACY_EPISODE:
+        start = raw.find(word)
+        if start != -1:
+            spans.append((start, start + len(word), "episode"))
+    spans.extend((m.start(), m.end(), "quality") for m in _LEGACY_QUALITY.finditer(raw))
+    spans.sort()
+    parts = []
+    pos = 0
+    for start, end, name in spans:
+        if start < pos:  # overlapping spellings can't both be replaced
+            continue
+        if start > pos:
+            parts.append(raw[pos:start])
+        parts.append([name, 0])
+        pos = end
+    if pos < len(raw):
+        parts.append(raw[pos:])
+    return parts
+
+
+def compile_template(raw):
+    """Validate `raw` and return its compiled form; raises TemplateError."""
+    raw = (raw or "").strip()
+    if not raw:
+        raise TemplateError("The format is empty")
+    return _compile_braces(raw) if "{" in raw or "}" in raw else _compile_legacy(raw)
+
+
+def template_tokens(compiled):
+    return {part[0] for part in compiled if isinstance(part, list)}
+
+
+def render_template(compiled, parsed, extension):
+    """Build the new file name from a ParsedName and the original extension
+    (with its dot). Missing values render as empty strings."""
+    values = parsed._asdict()
+    values["ext"] = extension.lstrip(".")
+    out = []
+    uses_ext = False
+    for part in compiled:
+        if isinstance(part, str):
+            out.append(part)
+            continue
+        name, width = part
+        uses_ext = uses_ext or name == "ext"
+        value = values.get(name) or ""
+        if width and value.isdigit():
+            value = value.zfill(width)
+        out.append(value)
+    if not uses_ext:
+        out.append(extension)
+    return "".join(out)
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from .metrics import CACHES
+
+logger = logging.getLogger(__name__)
+
+# Telegram only shows thumbnails that are JPEG, at most 320px per side and
+# under 200 KB
+THUMB_SIZE = (320, 320)
+THUMB_MAX_BYTES = 200 * 1024
+# A cached thumbnail this fresh may be in the middle of an upload
+EVICT_GRACE = 300
+
+_executor = ThreadPoolExecutor(max_workers=Config.THUMB_WORKERS, thread_name_prefix="thumb")
+
+
+def process_thumbnail(data):
+    """Decode, convert, fit and JPEG-encode an image in one go, in memory."""
+    from PIL import Image  # imported on first use; it adds a lot to startup
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("RGB")
+        img.thumbnail(THUMB_SIZE)
+        for quality in (90, 80, 70, 60, 50):
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=quality, optimize=True)
+            if out.tell() <= THUMB_MAX_BYTES:
+                break
+    return out.getvalue()
+
+
+class ThumbnailCache:
+    """Processed thumbnails on disk, keyed by the Telegram file_id they came
+    from and evicted least-recently-used once the directory outgrows
+    `max_bytes`.
+
+    Paths handed out belong to the cache; callers must not delete them.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._pending = {}  # file_id -> in-flight build task
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, file_id):
+        return os.path.join(self.path, hashlib.sha1(file_id.encode()).hexdigest() + ".jpg")
+
+    async def get(self, client, file_id):
+        path = self._file(file_id)
+        if os.path.exists(path):
+            os.utime(path)
+            self.hits += 1
+            return path
+        self.misses += 1
+        task = self._pending.get(file_id)
+        if task is None:
+            task = asyncio.ensure_future(self._build(client, file_id, path))
+            self._pending[file_id] = task
+            task.add_done_callback(lambda _: self._pending.pop(file_id, None))
+        return await asyncio.shield(task)
+
+    async def _build(self, client, file_id, path):
+        loop = asyncio.get_running_loop()
+        data = await client.download_media(file_id, in_memory=True)
+        jpeg = await loop.run_in_executor(_executor, process_thumbnail, bytes(data.getbuffer()))
+        await loop.run_in_executor(_executor, self._store, path, jpeg)
+        return path
+
+    def _store(self, path, jpeg):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(jpeg)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith(".jpg"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        now = time.time()
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes or now - mtime < EVICT_GRACE:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                logger.warning(f"Could not evict thumbnail {path}: {e}")
+
+
+thumbnails = ThumbnailCache(Config.THUMB_CACHE_DIR, Config.THUMB_CACHE_MB * 1024 * 1024)
+CACHES.register("thumbnail", thumbnails)
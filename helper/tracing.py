@@ -0,0 +1,89 @@
+"""Per-job stage timings.
+
+Every rename gets a JobTrace. Its stages feed the stage latency histogram,
+the finished trace is kept in a ring buffer for /timings, and a sample of
+traces (every failed one) is written as a JSON line to TRACE_LOG.
+"""
+import json
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import Config
+from .metrics import JOBS, STAGE_SECONDS
+
+recent_traces = deque(maxlen=Config.TRACE_BUFFER)
+
+trace_logger = logging.getLogger("renamer.trace")
+trace_logger.propagate = False
+if Config.TRACE_LOG:
+    _handler = logging.FileHandler(Config.TRACE_LOG)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(_handler)
+    trace_logger.setLevel(logging.INFO)
+
+
+class JobTrace:
+    """Stage durations and outcome of one rename job."""
+
+    def __init__(self, user_id, media_type, file_size):
+        self.user_id = user_id
+        self.media_type = media_type
+        self.file_size = file_size or 0
+        self.started = time.time()
+        self.created = time.monotonic()
+        self.stages = {}
+        self.outcome = None
+
+    def record(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def finish(self, outcome):
+        if self.outcome is not None:
+            return
+        self.outcome = outcome
+        self.stages["total"] = time.monotonic() - self.created
+        JOBS.inc(outcome=outcome)
+        recent_traces.append(self)
+        if trace_logger.handlers and (outcome == "failed" or random.random() < Config.TRACE_SAMPLE_RATE):
+            trace_logger.info(json.dumps(self.to_dict()))
+
+    def to_dict(self):
+        return {
+            "ts": round(self.started, 3),
+            "user_id": self.user_id,
+            "media_type": self.media_type,
+            "file_size": self.file_size,
+            "outcome": self.outcome,
+            "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+        }
+
+
+def _percentile(values, pct):
+    # nearest-rank on an already sorted list
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def stage_percentiles(last=None):
+    """{stage: (count, p50, p95, p99)} in seconds over the last `last` jobs."""
+    traces = list(recent_traces)[-last:] if last else list(recent_traces)
+    samples = {}
+    for trace in traces:
+        for stage, seconds in trace.stages.items():
+            samples.setdefault(stage, []).append(seconds)
+    result = {}
+    for stage, values in samples.items():
+        values.sort()
+        result[stage] = (len(values), _percentile(values, 50), _percentile(values, 95), _percentile(values, 99))
+    return result
@@ -0,0 +1,513 @@
+"""Streaming transfers: upload a file while it is still downloading.
+
+Downloaded chunks go into a StreamBuffer and the upload reads its parts
+straight back out, so a rename takes about max(download, upload) instead
+of download + upload, and at most the buffer's size sits in memory or on
+disk.
+
+Big files that do go through disk are downloaded by `download_chunks`,
+which fetches 1 MiB chunks over several connections at once and writes
+each one in place with pwrite, and uploaded by `upload_file`, which sends
+memoryview slices of an mmap of the file the same way.
+
+The engines only see small transport interfaces:
+
+* download: an async iterator of byte chunks, or for `download_chunks` an
+  `async fetch(index)` returning chunk `index`
+* upload: an object with `async save_part(index, total_parts, data)`
+
+The pyrogram transports at the bottom are the only code here that talks
+to Telegram, and benchmarks/bench_transfer.py drives the same engines with
+fake ones.
+"""
+import asyncio
+import logging
+import math
+import mmap
+import os
+import random
+from abc import ABC, abstractmethod
+from collections import deque
+from .metrics import TRANSFER_RETRIES
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 512 * 1024  # what Telegram expects for every part but the last
+CHUNK_SIZE = 1024 * 1024  # the largest upload.getFile limit
+BIG_FILE_SIZE = 10 * 1024 * 1024  # smaller files must use saveFilePart + md5
+
+
+class StreamBuffer:
+    """Bytes on their way from a download to an upload.
+
+    Chunks are held in memory up to `memory_limit` bytes, then appended to
+    a spill file at `spill_path` up to `spill_limit` bytes. When both are
+    full the writer waits for the reader. The reader always gets the bytes
+    back in the order they were written.
+    """
+
+    def __init__(self, memory_limit, spill_limit, spill_path):
+        self.memory_limit = memory_limit
+        self.spill_limit = spill_limit
+        self.spill_path = spill_path
+        self.written = 0
+        self._segments = deque()  # bytes in memory, or (offset, length) in the spill file
+        self._memory = 0
+        self._spilled = 0
+        self._spill_fd = None
+        self._spill_end = 0
+        self._eof = False
+        self._error = None
+        self._cond = asyncio.Condition()
+
+    @property
+    def buffered(self):
+        return self._memory + self._spilled
+
+    def _placement(self, size):
+        if not self._segments or self._memory + size <= self.memory_limit:
+            return "memory"
+        if self._spilled + size <= self.spill_limit:
+            return "spill"
+        return None
+
+    async def write(self, chunk):
+        loop = asyncio.get_running_loop()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._error is not None or self._placement(len(chunk)))
+            if self._error is not None:
+                raise self._error
+            if self._placement(len(chunk)) == "memory":
+                self._segments.append(bytes(chunk))
+                self._memory += len(chunk)
+            else:
+                if self._spill_fd is None:
+                    self._spill_fd = os.open(self.spill_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+                offset = self._spill_end
+                await loop.run_in_executor(None, os.pwrite, self._spill_fd, chunk, offset)
+                self._segments.append((offset, len(chunk)))
+                self._spill_end += len(chunk)
+                self._spilled += len(chunk)
+            self.written += len(chunk)
+            self._cond.notify_all()
+
+    async def close(self, error=None):
+        """End of the stream, or the error the reader should raise."""
+        async with self._cond:
+            if error is not None:
+                self._error = error
+            self._eof = True
+            self._cond.notify_all()
+
+    async def read(self, size):
+        """Exactly `size` bytes, or fewer only at the end of the stream."""
+        loop = asyncio.get_running_loop()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._error is not None or self._eof or self.buffered >= size)
+            if self._error is not None:
+                raise self._error
+            out = []
+            needed = size
+            while needed and self._segments:
+                segment = self._segments[0]
+                if isinstance(segment, bytes):
+                    piece = segment[:needed]
+                    self._memory -= len(piece)
+                    if len(piece) < len(segment):
+                        self._segments[0] = segment[len(piece):]
+                    else:
+                        self._segments.popleft()
+                else:
+                    offset, length = segment
+                    take = min(needed, length)
+                    piece = await loop.run_in_executor(None, os.pread, self._spill_fd, take, offset)
+                    self._spilled -= take
+                    if take < length:
+                        self._segments[0] = (offset + take, length - take)
+                    else:
+                        self._segments.popleft()
+                    if not self._spilled:
+                        self._spill_end = 0  # nothing pending on disk, start over
+                out.append(piece)
+                needed -= len(piece)
+            self._cond.notify_all()
+            return b"".join(out)
+
+    def discard(self):
+        if self._spill_fd is not None:
+            os.close(self._spill_fd)
+            self._spill_fd = None
+        try:
+            os.remove(self.spill_path)
+        except FileNotFoundError:
+            pass
+
+
+async def pump(chunks, buffer, size=None, progress=None):
+    """Download engine: copy an async iterator of chunks into `buffer`."""
+    done = 0
+    try:
+        async for chunk in chunks:
+            await buffer.write(chunk)
+            done += len(chunk)
+            if progress:
+                await progress(done, size or done)
+    except BaseException as e:
+        await buffer.close(e if isinstance(e, Exception) else ConnectionError("download cancelled"))
+        raise
+    await buffer.close()
+    return done
+
+
+async def upload_parts(transport, read, size, part_size=PART_SIZE, workers=4, retries=0, progress=None):
+    """Upload engine: read `size` bytes through `read(n)` and save them as
+    parts, up to `workers` at a time, each retried on its own up to
+    `retries` times. Returns the number of parts."""
+    total_parts = math.ceil(size / part_size)
+    slots = asyncio.Semaphore(workers)
+    pending = set()
+    errors = []
+    uploaded = 0
+
+    async def send(index, data):
+        nonlocal uploaded
+        try:
+            await retry(lambda: transport.save_part(index, total_parts, data), retries, "upload", f"Part {index}")
+        except Exception as e:
+            errors.append(e)
+            return
+        finally:
+            slots.release()
+        uploaded += len(data)
+        if progress:
+            await progress(uploaded, size)
+
+    try:
+        for index in range(total_parts):
+            await slots.acquire()
+            if errors:
+                raise errors[0]
+            expected = min(part_size, size - index * part_size)
+            data = await read(expected)
+            if len(data) != expected:
+                raise IOError(f"Stream ended after {index * part_size + len(data)} of {size} bytes")
+            task = asyncio.ensure_future(send(index, data))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+        if errors:
+            raise errors[0]
+    except BaseException:
+        tasks = list(pending)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return total_parts
+
+
+async def upload_file(transport, path, part_size=PART_SIZE, workers=4, retries=0, progress=None):
+    """Upload the file at `path` with `upload_parts`, reading it through
+    mmap so every part is a slice of the page cache rather than a copy.
+    Returns (size, number of parts)."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        offset = 0
+
+        async def read(n):
+            nonlocal offset
+            data = view[offset:offset + n]
+            offset += len(data)
+            return data
+
+        try:
+            parts = await upload_parts(transport, read, size, part_size, workers, retries, progress)
+        finally:
+            view.release()
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # a failed part's traceback still holds a slice; unmapped when it is collected
+    return size, parts
+
+
+async def stream_transfer(chunks, transport, buffer, size, workers=4, retries=0, download_progress=None, upload_progress=None):
+    """Run the download into `buffer` and the upload out of it at the same
+    time. Returns the number of parts uploaded."""
+    download = asyncio.ensure_future(pump(chunks, buffer, size, download_progress))
+    try:
+        parts = await upload_parts(transport, buffer.read, size, workers=workers, retries=retries, progress=upload_progress)
+    except BaseException as e:
+        # fail the download side too, so a writer waiting for room wakes up
+        await buffer.close(e if isinstance(e, Exception) else ConnectionError("upload cancelled"))
+        download.cancel()
+        raise
+    await download  # surfaces a download error the upload did not notice
+    return parts
+
+
+async def retry(call, retries, direction, what):
+    """Await `call()`, retrying failures up to `retries` times with backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries:
+                raise
+            TRANSFER_RETRIES.inc(direction=direction)
+            logger.warning(f"{what} failed ({e!r}), retry {attempt + 1}/{retries}")
+            await asyncio.sleep(min(2 ** attempt, 10))
+
+
+async def download_chunks(fetch, path, size, chunk_size=CHUNK_SIZE, workers=4, retries=3, progress=None):
+    """Parallel download engine: fetch the `size` bytes chunk by chunk
+    through `fetch(index)`, up to `workers` chunks at a time, and write each
+    into its place in a preallocated file at `path`."""
+    loop = asyncio.get_running_loop()
+    total_chunks = math.ceil(size / chunk_size)
+    indexes = iter(range(total_chunks))  # shared: each worker takes the next chunk
+    done = 0
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, size)  # filesystems without fallocate get a sparse file
+
+        async def fetch_checked(index):
+            expected = min(chunk_size, size - index * chunk_size)
+            data = await fetch(index)
+            if len(data) != expected:
+                raise IOError(f"Chunk {index} has {len(data)} bytes, expected {expected}")
+            return data
+
+        async def worker():
+            nonlocal done
+            for index in indexes:
+                data = await retry(lambda: fetch_checked(index), retries, "download", f"Chunk {index}")
+                await loop.run_in_executor(None, os.pwrite, fd, data, index * chunk_size)
+                done += len(data)
+                if progress:
+                    await progress(done, size)
+
+        tasks = [asyncio.ensure_future(worker()) for _ in range(min(workers, total_chunks))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    finally:
+        os.close(fd)
+    return done
+
+
+# --- pyrogram transports ----------------------------------------------------
+
+async def media_session(client, dc_id, auth_key=None):
+    """A started media Session on `dc_id`. For a DC other than the bot's own
+    pass the `auth_key` of an authorized session there, or a new one is
+    created and authorized."""
+    from pyrogram import raw
+    from pyrogram.errors import AuthBytesInvalid
+    from pyrogram.session import Auth, Session
+    storage = client.storage
+    test_mode = await storage.test_mode()
+    if dc_id == await storage.dc_id():
+        session = Session(client, dc_id, await storage.auth_key(), test_mode, is_media=True)
+        await session.start()
+        return session
+    authorize = auth_key is None
+    if authorize:
+        auth_key = await Auth(client, dc_id, test_mode).create()
+    session = Session(client, dc_id, auth_key, test_mode, is_media=True)
+    await session.start()
+    if authorize:
+        # Same dance as pyrogram's own get_file
+        for _ in range(3):
+            exported = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+            try:
+                await session.invoke(raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes))
+            except AuthBytesInvalid:
+                continue
+            break
+        else:
+            await session.stop()
+            raise AuthBytesInvalid
+    return session
+
+
+async def media_sessions(client, dc_id, count):
+    """`count` media sessions on `dc_id`, shared by every transfer until the
+    client stops.
+
+    The first is pyrogram's own media session for the DC, the one get_file
+    uses; the others reuse its auth key. A foreign DC's key exchange and
+    authorization therefore happen once per process, not once per file.
+    """
+    async with client.media_sessions_lock:
+        first = client.media_sessions.get(dc_id)
+        if first is None:
+            first = await media_session(client, dc_id)
+            client.media_sessions[dc_id] = first
+        extra = client.__dict__.setdefault("transfer_sessions", {}).setdefault(dc_id, [])
+        while len(extra) < count - 1:
+            extra.append(await media_session(client, dc_id, first.auth_key))
+    return [first] + extra[:count - 1]
+
+
+async def stop_media_sessions(client):
+    """Stop the extra sessions media_sessions opened; pyrogram stops its
+    own when the client stops."""
+    for sessions in client.__dict__.pop("transfer_sessions", {}).values():
+        for session in sessions:
+            await session.stop()
+
+
+class PyrogramDownloadTransport:
+    """Fetches chunks of a message's document with upload.getFile, spread
+    over `connections` media sessions to the file's DC."""
+
+    def __init__(self, client, message, connections=2):
+        from pyrogram import raw
+        from pyrogram.file_id import FileId
+        self.client = client
+        self.message = message
+        self.connections = connections
+        media = getattr(message, message.media.value)
+        self.file_id = FileId.decode(media.file_id)
+        self.location = raw.types.InputDocumentFileLocation(
+            id=self.file_id.media_id,
+            access_hash=self.file_id.access_hash,
+            file_reference=self.file_id.file_reference,
+            thumb_size=self.file_id.thumbnail_size,
+        )
+        self.sessions = []
+
+    async def start(self):
+        self.sessions = await media_sessions(self.client, self.file_id.dc_id, self.connections)
+
+    async def fetch(self, index):
+        from pyrogram import raw
+        r = await self.sessions[index % len(self.sessions)].invoke(
+            raw.functions.upload.GetFile(location=self.location, offset=index * CHUNK_SIZE, limit=CHUNK_SIZE),
+            sleep_threshold=30,
+        )
+        if isinstance(r, raw.types.upload.File):
+            return r.bytes
+        # CDN-hosted file: let pyrogram handle the redirect for this chunk
+        return b"".join([chunk async for chunk in self.client.stream_media(self.message, offset=index, limit=1)])
+
+
+async def parallel_download(client, message, path, size, connections=2, workers=8, retries=3, progress=None):
+    """Download `message`'s media to `path` over several connections."""
+    transport = PyrogramDownloadTransport(client, message, connections)
+    await transport.start()
+    return await download_chunks(transport.fetch, path, size, workers=workers, retries=retries, progress=progress)
+
+
+class PyrogramUploadTransport:
+    """Saves parts of one big file with upload.saveBigFilePart, spread over
+    `connections` media sessions on the bot's own DC."""
+
+    def __init__(self, client, connections=1, file_id=None):
+        self.client = client
+        self.connections = connections
+        self.file_id = random.getrandbits(63) if file_id is None else file_id
+        self.sessions = []
+
+    async def start(self):
+        self.sessions = await media_sessions(self.client, await self.client.storage.dc_id(), self.connections)
+
+    async def save_part(self, index, total_parts, data):
+        from pyrogram import raw
+        await self.sessions[index % len(self.sessions)].invoke(raw.functions.upload.SaveBigFilePart(
+            file_id=self.file_id, file_part=index, file_total_parts=total_parts, bytes=data,
+        ))
+
+
+class UploadSource(ABC):
+    """Stands in for a file path in send_document/send_video/send_audio.
+
+    The bot's save_file override hands it to `save`, which uploads the
+    parts itself and returns the InputFileBig that send_* finishes the
+    upload with.
+    """
+
+    def __init__(self, name, size, connections=1, workers=4, retries=0):
+        self.name = name
+        self.size = size
+        self.connections = connections
+        self.workers = workers
+        self.retries = retries
+
+    async def save(self, client, file_id=None, file_part=0, progress=None, progress_args=()):
+        from pyrogram import raw
+        if file_id is not None:
+            # Telegram lost a part of an upload send_* thought was complete
+            transport = PyrogramUploadTransport(client, file_id=file_id)
+            await transport.start()
+            await self.resend(transport, file_part)
+            return None
+
+        async def upload_progress(current, total):
+            if progress:
+                await progress(current, total, *progress_args)
+
+        transport = PyrogramUploadTransport(client, self.connections)
+        await transport.start()
+        parts = await self.upload(transport, upload_progress)
+        return raw.types.InputFileBig(id=transport.file_id, parts=parts, name=self.name)
+
+    @abstractmethod
+    async def upload(self, transport, progress):
+        """Upload every part through `transport`; returns the part count."""
+
+    @abstractmethod
+    async def resend(self, transport, index):
+        """Save part `index` again."""
+
+
+class ParallelUpload(UploadSource):
+    """A file on disk, uploaded with `upload_file`."""
+
+    def __init__(self, path, name, connections=1, workers=4, retries=0):
+        super().__init__(name, os.path.getsize(path), connections, workers, retries)
+        self.path = path
+
+    async def upload(self, transport, progress):
+        _, parts = await upload_file(transport, self.path, workers=self.workers, retries=self.retries, progress=progress)
+        return parts
+
+    async def resend(self, transport, index):
+        total_parts = math.ceil(self.size / PART_SIZE)
+        with open(self.path, "rb") as f:
+            f.seek(index * PART_SIZE)
+            data = f.read(PART_SIZE)
+        await retry(lambda: transport.save_part(index, total_parts, data), self.retries, "upload", f"Part {index}")
+
+
+class StreamingUpload(UploadSource):
+    """The media of `message`, uploaded while it downloads through `buffer`."""
+
+    def __init__(self, client, message, name, size, buffer, connections=1, workers=4, retries=0, download_progress=None):
+        super().__init__(name, size, connections, workers, retries)
+        self.client = client
+        self.message = message
+        self.buffer = buffer
+        self.download_progress = download_progress
+
+    async def upload(self, transport, progress):
+        return await stream_transfer(
+            self.client.stream_media(self.message), transport, self.buffer, self.size, workers=self.workers,
+            retries=self.retries, download_progress=self.download_progress, upload_progress=progress,
+        )
+
+    async def resend(self, transport, index):
+        # The stream has moved past the part
+        raise ValueError("A streamed upload cannot re-send a single part")
@@ -1,42 +1,146 @@
 import math, time
+from collections import deque
 from datetime import datetime
-from pytz import timezone
 from config import Config, Txt 
+from pyrogram.errors import FloodWait
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from .ratelimit import TokenBucket
+from .metrics import TRANSFER_BYTES, TRANSFER_THROUGHPUT, floodwait
 
-async def progress_for_pyrogram(current, total, ud_type, message, start):
-    now = time.time()
-    diff = now - start
-    if round(diff % 5.00) == 0 or current == total:        
+# Built once; every progress edit carries the same keyboard
+CANCEL_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("✖️ Cancel ✖️", callback_data="close")]])
+
+# Budget shared by every running job, so many parallel transfers together
+# stay well clear of Telegram's edit limits
+progress_edits = TokenBucket(Config.PROGRESS_EDITS_PER_SECOND)
+
+
+class ProgressReporter:
+    """Progress callback for one status message.
+
+    Pass `reporter.update` as pyrogram's `progress`. Edits happen at most
+    once per `interval` seconds, only when the rendered text changed and
+    only if the shared edit budget has a token free. None of them wait for
+    one, not even the final 100% edit: pyrogram awaits this callback, so
+    waiting would hold up the transfer and its slot. Speed and ETA come
+    from the bytes moved during the last `window` seconds, not the average
+    since the start.
+
+    With `direction` ("download" or "upload") the bytes moved and the final
+    average speed are also recorded in the transfer metrics; with no
+    `message` that is all it does.
+    """
+
+    def __init__(self, message, ud_type, interval=None, window=None, direction=None):
+        self.message = message
+        self.ud_type = ud_type
+        self.direction = direction
+        self._started = time.monotonic()
+        self._current = 0
+        self.interval = Config.PROGRESS_INTERVAL if interval is None else interval
+        self.window = Config.PROGRESS_WINDOW if window is None else window
+        self._samples = deque()
+        self._last_edit = 0
+        self._last_text = None
+
+    def _speed(self, now, current):
+        samples = self._samples
+        samples.append((now, current))
+        while len(samples) > 2 and now - samples[1][0] >= self.window:
+            samples.popleft()
+        first_time, first_bytes = samples[0]
+        if now <= first_time:
+            return 0
+        return (current - first_bytes) / (now - first_time)
+
+    def render(self, current, total, speed):
         percentage = current * 100 / total
-        speed = current / diff
-        elapsed_time = round(diff) * 1000
-        time_to_completion = round((total - current) / speed) * 1000
-        estimated_total_time = elapsed_time + time_to_completion
-
-        elapsed_time = TimeFormatter(milliseconds=elapsed_time)
-        estimated_total_time = TimeFormatter(milliseconds=estimated_total_time)
-
-        progress = "{0}{1}".format(
-            ''.join(["⬢" for i in range(math.floor(percentage / 5))]),
-            ''.join(["⬡" for i in range(20 - math.floor(percentage / 5))])
-        )            
+        eta = round((total - current) / speed) * 1000 if speed else 0
+        filled = math.floor(percentage / 5)
+        progress = "⬢" * filled + "⬡" * (20 - filled)
         tmp = progress + Txt.PROGRESS_BAR.format( 
             round(percentage, 2),
             humanbytes(current),
             humanbytes(total),
             humanbytes(speed),            
-            estimated_total_time if estimated_total_time != '' else "0 s"
+            TimeFormatter(milliseconds=eta) or "0 s"
         )
+        return f"{self.ud_type}\n\n{tmp}"
+
+    async def update(self, current, total):
+        now = time.monotonic()
+        speed = self._speed(now, current)
+        finished = current == total
+        if self.direction:
+            self._record(now, current, total, finished)
+        if self.message is None:
+            return
+        if not total or (not finished and now - self._last_edit < self.interval):
+            return
+        text = self.render(current, total, speed)
+        if text == self._last_text or not progress_edits.try_acquire():
+            return
+        self._last_edit = now
+        self._last_text = text
         try:
-            await message.edit(
-                text=f"{ud_type}\n\n{tmp}",               
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✖️ Cancel ✖️", callback_data="close")]])                                               
-            )
-        except:
+            await self.message.edit(text=text, reply_markup=CANCEL_MARKUP)
+        except FloodWait as e:
+            floodwait(e.value, "progress")
+            progress_edits.pause(e.value)
+        except Exception:
             pass
-            
-            
+
+    def _record(self, now, current, total, finished):
+        TRANSFER_BYTES.inc(current - self._current, direction=self.direction)
+        self._current = current
+        if finished and total and now > self._started:
+            TRANSFER_THROUGHPUT.observe(total / (now - self._started), direction=self.direction)
+
+
+class BatchProgress:
+    """One status message for a batch whose downloads and uploads overlap.
+
+    The bar follows the bytes uploaded across the whole batch; the header
+    counts finished downloads and uploads.
+    """
+
+    def __init__(self, message, count, total_bytes):
+        self.reporter = ProgressReporter(message, "")
+        self.count = count
+        self.total = total_bytes or 1
+        self.downloaded = 0
+        self.uploaded = 0
+        self.failed = 0
+        self._uploaded_bytes = 0
+        self._current_upload = 0
+
+    def tracker(self, direction):
+        """A progress callback for one file's download or upload."""
+        metrics = ProgressReporter(None, "", direction=direction)
+
+        async def update(current, total):
+            await metrics.update(current, total)
+            if direction == "upload":
+                self._current_upload = current
+            await self.refresh()
+        return update
+
+    def file_done(self, direction, size):
+        if direction == "download":
+            self.downloaded += 1
+        else:
+            self.uploaded += 1
+            self._uploaded_bytes += size or 0
+            self._current_upload = 0
+
+    async def refresh(self):
+        header = f"Batch Of {self.count} Files\n\nDownloaded : {self.downloaded} / {self.count}\nUploaded : {self.uploaded} / {self.count}"
+        if self.failed:
+            header += f"\nFailed : {self.failed}"
+        self.reporter.ud_type = header
+        await self.reporter.update(min(self._uploaded_bytes + self._current_upload, self.total), self.total)
+
+
 
 def humanbytes(size):    
     if not size:
@@ -72,6 +176,7 @@ def convert(seconds):
 
 async def send_log(b, u):
     if Config.LOG_CHANNEL is not None:
+        from pytz import timezone  # only needed here; kept out of startup
         curr = datetime.now(timezone("Asia/Kolkata"))
         date = curr.strftime('%d %B, %Y')
         time = curr.strftime('%I:%M:%S %p')
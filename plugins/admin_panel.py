@@ -1,9 +1,14 @@
 from config import Config, Txt
 from helper.database import madflixbotz
+from helper.scheduler import scheduler
+from helper.broadcast import Broadcast, run_in_background
+from helper.metrics import RENAME_PATHS
+from helper.tracing import stage_percentiles
+from helper.jobs import ACTIVE_STATES, job_queue
+from helper.shutdown import drain
 from pyrogram.types import Message
 from pyrogram import Client, filters
-from pyrogram.errors import FloodWait, InputUserDeactivated, UserIsBlocked, PeerIdInvalid
-import os, sys, time, asyncio, logging, datetime
+import os, sys, time, asyncio, logging
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 logger = logging.getLogger(__name__)
@@ -18,22 +23,38 @@ async def restart_bot(b, m):
     global is_restarting
     if not is_restarting:
         is_restarting = True
-        await m.reply_text("**🔄 Restarting.....**")
+        status = await m.reply_text("**🔄 Restarting.....**\n\nFinishing Running Renames First.")
+        # Drained in the background so this handler returns and stop() doesn't wait on it
+        _restart_tasks.add(asyncio.create_task(drain_and_restart(b, status)))
 
-        # Gracefully stop the bot's event loop
-        b.stop()
-        time.sleep(2)  # Adjust the delay duration based on your bot's shutdown time
 
-        # Restart the bot process
-        os.execl(sys.executable, sys.executable, *sys.argv)
+_restart_tasks = set()
+
+
+async def drain_and_restart(b, status):
+    async def report(active, queued, left):
+        try:
+            await status.edit(f"**🔄 Restarting.....**\n\n**⚙️ Running Jobs :** `{active}` \n**⏳ Queued Jobs :** `{queued}` \n**⌛ Restart In :** `{int(left)}s` at most")
+        except Exception:
+            pass
+
+    finished, released = await drain(Config.RESTART_DRAIN_TIMEOUT, report)
+    try:
+        await status.edit(f"**🔄 Restarting Now.....**\n\n{'All Running Renames Finished.' if finished else 'Deadline Reached.'} \n**📦 Jobs Handed Over :** `{released}`")
+    except Exception:
+        pass
+    await b.stop()
+
+    # Restart the bot process
+    os.execl(sys.executable, sys.executable, *sys.argv)
 
 
 @Client.on_message(filters.private & filters.command(["tutorial"]))
 async def tutorial(bot,message):
 	user_id = message.from_user.id
-	format_template = await madflixbotz.get_format_template(user_id)
+	settings = await madflixbotz.get_user_settings(user_id, fields=("format_template",))
 	await message.reply_text(
-	    text =Txt.FILE_NAME_TXT.format(format_template=format_template),
+	    text =Txt.FILE_NAME_TXT.format(format_template=settings.format_template),
 	    disable_web_page_preview=True,
 	    reply_markup=InlineKeyboardMarkup([
         			[InlineKeyboardButton("🦋 Admin",url = "https://t.me/CallAdminRobot"), 
@@ -49,52 +70,41 @@ async def get_stats(bot, message):
     st = await message.reply('**Accessing The Details.....**')    
     end_t = time.time()
     time_taken_s = (end_t - start_t) * 1000
-    await st.edit(text=f"**--Bot Status--** \n\n**⌚️ Bot Uptime :** {uptime} \n**🐌 Current Ping :** `{time_taken_s:.3f} ms` \n**👭 Total Users :** `{total_users}`")
+    await st.edit(text=f"**--Bot Status--** \n\n**⌚️ Bot Uptime :** {uptime} \n**🐌 Current Ping :** `{time_taken_s:.3f} ms` \n**👭 Total Users :** `{total_users}` \n**⚙️ Active Jobs :** `{scheduler.active}` \n**⏳ Queued Jobs :** `{scheduler.queued}` \n**⚡ Fast / Cached / Full Renames :** `{RENAME_PATHS.value(path='fast')}` / `{RENAME_PATHS.value(path='cached')}` / `{RENAME_PATHS.value(path='full')}` \n**🗂 User Cache :** `{madflixbotz.user_cache.hits}` hits / `{madflixbotz.user_cache.misses}` misses")
+
+@Client.on_message(filters.command("jobs") & filters.user(Config.ADMIN))
+async def get_jobs(bot, message):
+    # Live jobs of every worker sharing the database
+    counts = await madflixbotz.count_jobs_by_state()
+    lines = "\n".join(f"**{state.title()} :** `{counts.get(state, 0)}`" for state in ACTIVE_STATES)
+    await message.reply_text(f"**--Rename Jobs--**\n\n{lines}\n**Held By This Worker :** `{len(job_queue.local)}`")
+
+@Client.on_message(filters.command("timings") & filters.user(Config.ADMIN))
+async def get_timings(bot, message):
+    # /timings [N] : stage latency percentiles over the last N jobs
+    last = int(message.command[1]) if len(message.command) > 1 and message.command[1].isdigit() else None
+    stats = stage_percentiles(last)
+    if not stats:
+        return await message.reply_text("No Renames Recorded Yet.")
+    lines = [f"{'stage':9} {'jobs':>5} {'p50':>7} {'p95':>7} {'p99':>7}"]
+    for stage in ("queue", "parse", "result_cache", "disk", "download", "metadata", "stream", "thumb", "upload", "total"):
+        if stage in stats:
+            count, p50, p95, p99 = stats[stage]
+            lines.append(f"{stage:9} {count:>5} {p50:>6.2f}s {p95:>6.2f}s {p99:>6.2f}s")
+    await message.reply_text("**--Stage Timings--**\n\n```\n" + "\n".join(lines) + "\n```")
+
+@Client.on_message(filters.command("purge_results") & filters.user(Config.ADMIN))
+async def purge_results(bot, message):
+    # Forget every cached rename output, e.g. after changing how files are built
+    deleted = await madflixbotz.purge_rename_results()
+    await message.reply_text(f"**🗑 Cleared {deleted} Cached Renames.**")
 
 @Client.on_message(filters.command("broadcast") & filters.user(Config.ADMIN) & filters.reply)
 async def broadcast_handler(bot: Client, m: Message):
     await bot.send_message(Config.LOG_CHANNEL, f"{m.from_user.mention} or {m.from_user.id} Is Started The Broadcast......")
-    all_users = await madflixbotz.get_all_users()
-    broadcast_msg = m.reply_to_message
     sts_msg = await m.reply_text("Broadcast Started..!") 
-    done = 0
-    failed = 0
-    success = 0
-    start_time = time.time()
-    total_users = await madflixbotz.total_users_count()
-    async for user in all_users:
-        sts = await send_msg(user['_id'], broadcast_msg)
-        if sts == 200:
-           success += 1
-        else:
-           failed += 1
-        if sts == 400:
-           await madflixbotz.delete_user(user['_id'])
-        done += 1
-        if not done % 20:
-           await sts_msg.edit(f"Broadcast In Progress: \n\nTotal Users {total_users} \nCompleted : {done} / {total_users}\nSuccess : {success}\nFailed : {failed}")
-    completed_in = datetime.timedelta(seconds=int(time.time() - start_time))
-    await sts_msg.edit(f"Bʀᴏᴀᴅᴄᴀꜱᴛ Cᴏᴍᴩʟᴇᴛᴇᴅ: \nCᴏᴍᴩʟᴇᴛᴇᴅ Iɴ `{completed_in}`.\n\nTotal Users {total_users}\nCompleted: {done} / {total_users}\nSuccess: {success}\nFailed: {failed}")
-           
-async def send_msg(user_id, message):
-    try:
-        await message.copy(chat_id=int(user_id))
-        return 200
-    except FloodWait as e:
-        await asyncio.sleep(e.value)
-        return send_msg(user_id, message)
-    except InputUserDeactivated:
-        logger.info(f"{user_id} : Deactivated")
-        return 400
-    except UserIsBlocked:
-        logger.info(f"{user_id} : Blocked The Bot")
-        return 400
-    except PeerIdInvalid:
-        logger.info(f"{user_id} : User ID Invalid")
-        return 400
-    except Exception as e:
-        logger.error(f"{user_id} : {e}")
-        return 500
+    broadcast = await Broadcast.start(bot, m.reply_to_message, sts_msg)
+    run_in_background(broadcast)
 
 
 
@@ -1,6 +1,7 @@
 from pyrogram import Client, filters
 from pyrogram.errors import FloodWait
 from helper.database import madflixbotz
+from helper.template import TemplateError, compile_template
 
 @Client.on_message(filters.private & filters.command("autorename"))
 async def auto_rename_command(client, message):
@@ -9,8 +10,14 @@ async def auto_rename_command(client, message):
     # Extract the format from the command
     format_template = message.text.split("/autorename", 1)[1].strip()
 
-    # Save the format template to the database
-    await madflixbotz.set_format_template(user_id, format_template)
+    # Check it now rather than on the first upload
+    try:
+        format_compiled = compile_template(format_template)
+    except TemplateError as e:
+        return await message.reply_text(f"**Invalid Auto Rename Format ❌**\n\n{e}")
+
+    # Save the format template to the database, compiled form alongside
+    await madflixbotz.update_user_settings(user_id, format_template=format_template, format_compiled=format_compiled)
 
     await message.reply_text("**Auto Rename Format Updated Successfully! ✅**")
 
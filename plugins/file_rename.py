@@ -1,290 +1,582 @@
 from pyrogram import Client, filters
 from pyrogram.errors import FloodWait
 from pyrogram.types import InputMediaDocument, Message 
-from PIL import Image
-from datetime import datetime
-from hachoir.metadata import extractMetadata
-from hachoir.parser import createParser
-from helper.utils import progress_for_pyrogram, humanbytes, convert
+from helper.utils import BatchProgress, ProgressReporter, humanbytes, convert
+from helper.parser import parse_filename
+from helper.template import TemplateError, compile_template, render_template, template_tokens
 from helper.database import madflixbotz
+from helper.scheduler import scheduler
+from helper.thumbnail import thumbnails
+from helper.metadata import extract_metadata
+from helper.storage import MB, reserve_scratch
+from helper.transfer import BIG_FILE_SIZE, ParallelUpload, StreamBuffer, StreamingUpload, parallel_download
+from helper.results import rename_results
+from helper.metrics import CACHES, RENAME_PATHS
+from helper.tracing import JobTrace
+from helper.cache import DedupIndex
+from helper.batch import Batcher
+from helper.jobs import job_queue
+from helper.shutdown import on_drain
+from helper.shards import shard_of, supervisor
 from config import Config
+from functools import partial
+import asyncio
+import logging
 import os
 import time
-import re
-
-renaming_operations = {}
-
-# Pattern 1: S01E02 or S01EP02
-pattern1 = re.compile(r'S(\d+)(?:E|EP)(\d+)')
-# Pattern 2: S01 E02 or S01 EP02 or S01 - E01 or S01 - EP02
-pattern2 = re.compile(r'S(\d+)\s*(?:E|EP|-\s*EP)(\d+)')
-# Pattern 3: Episode Number After "E" or "EP"
-pattern3 = re.compile(r'(?:[([<{]?\s*(?:E|EP)\s*(\d+)\s*[)\]>}]?)')
-# Pattern 3_2: episode number after - [hyphen]
-pattern3_2 = re.compile(r'(?:\s*-\s*(\d+)\s*)')
-# Pattern 4: S2 09 ex.
-pattern4 = re.compile(r'S(\d+)[^\d]*(\d+)', re.IGNORECASE)
-# Pattern X: Standalone Episode Number
-patternX = re.compile(r'(\d+)')
-#QUALITY PATTERNS 
-# Pattern 5: 3-4 digits before 'p' as quality
-pattern5 = re.compile(r'\b(?:.*?(\d{3,4}[^\dp]*p).*?|.*?(\d{3,4}p))\b', re.IGNORECASE)
-# Pattern 6: Find 4k in brackets or parentheses
-pattern6 = re.compile(r'[([<{]?\s*4k\s*[)\]>}]?', re.IGNORECASE)
-# Pattern 7: Find 2k in brackets or parentheses
-pattern7 = re.compile(r'[([<{]?\s*2k\s*[)\]>}]?', re.IGNORECASE)
-# Pattern 8: Find HdRip without spaces
-pattern8 = re.compile(r'[([<{]?\s*HdRip\s*[)\]>}]?|\bHdRip\b', re.IGNORECASE)
-# Pattern 9: Find 4kX264 in brackets or parentheses
-pattern9 = re.compile(r'[([<{]?\s*4kX264\s*[)\]>}]?', re.IGNORECASE)
-# Pattern 10: Find 4kx265 in brackets or parentheses
-pattern10 = re.compile(r'[([<{]?\s*4kx265\s*[)\]>}]?', re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+# Files running or renamed in the last DEDUP_TTL seconds, per user, keyed by
+# file_unique_id so the same file forwarded twice is only renamed once
+renaming_operations = DedupIndex(Config.DEDUP_MAX_KEYS, Config.DEDUP_TTL, Config.DEDUP_MAX_JOB_AGE)
+CACHES.register("dedup", renaming_operations)
 
 def extract_quality(filename):
-    # Try Quality Patterns
-    match5 = re.search(pattern5, filename)
-    if match5:
-        print("Matched Pattern 5")
-        quality5 = match5.group(1) or match5.group(2)  # Extracted quality from both patterns
-        print(f"Quality: {quality5}")
-        return quality5
-
-    match6 = re.search(pattern6, filename)
-    if match6:
-        print("Matched Pattern 6")
-        quality6 = "4k"
-        print(f"Quality: {quality6}")
-        return quality6
-
-    match7 = re.search(pattern7, filename)
-    if match7:
-        print("Matched Pattern 7")
-        quality7 = "2k"
-        print(f"Quality: {quality7}")
-        return quality7
-
-    match8 = re.search(pattern8, filename)
-    if match8:
-        print("Matched Pattern 8")
-        quality8 = "HdRip"
-        print(f"Quality: {quality8}")
-        return quality8
-
-    match9 = re.search(pattern9, filename)
-    if match9:
-        print("Matched Pattern 9")
-        quality9 = "4kX264"
-        print(f"Quality: {quality9}")
-        return quality9
-
-    match10 = re.search(pattern10, filename)
-    if match10:
-        print("Matched Pattern 10")
-        quality10 = "4kx265"
-        print(f"Quality: {quality10}")
-        return quality10    
-
-    # Return "Unknown" if no pattern matches
-    unknown_quality = "Unknown"
-    print(f"Quality: {unknown_quality}")
-    return unknown_quality
+    quality = parse_filename(filename).quality or "Unknown"
+    logger.debug("Quality: %s", quality)
+    return quality
     
 
 def extract_episode_number(filename):    
-    # Try Pattern 1
-    match = re.search(pattern1, filename)
-    if match:
-        print("Matched Pattern 1")
-        return match.group(2)  # Extracted episode number
-    
-    # Try Pattern 2
-    match = re.search(pattern2, filename)
-    if match:
-        print("Matched Pattern 2")
-        return match.group(2)  # Extracted episode number
-
-    # Try Pattern 3
-    match = re.search(pattern3, filename)
-    if match:
-        print("Matched Pattern 3")
-        return match.group(1)  # Extracted episode number
-
-    # Try Pattern 3_2
-    match = re.search(pattern3_2, filename)
-    if match:
-        print("Matched Pattern 3_2")
-        return match.group(1)  # Extracted episode number
-        
-    # Try Pattern 4
-    match = re.search(pattern4, filename)
-    if match:
-        print("Matched Pattern 4")
-        return match.group(2)  # Extracted episode number
-
-    # Try Pattern X
-    match = re.search(patternX, filename)
-    if match:
-        print("Matched Pattern X")
-        return match.group(1)  # Extracted episode number
-        
-    # Return None if no pattern matches
+    return parse_filename(filename).episode
+
+
+def build_caption(settings, new_file_name, file_size, duration):
+    c_caption = settings.caption
+    return c_caption.format(filename=new_file_name, filesize=humanbytes(file_size), duration=convert(duration)) if c_caption else f"**{new_file_name}**"
+
+
+def thumb_file_id(message, media_type, settings):
+    # The user's thumbnail, else the video's own one when it stays a video
+    if settings.thumbnail:
+        return settings.thumbnail
+    if media_type == "video" and message.video and message.video.thumbs:
+        return message.video.thumbs[0].file_id
     return None
 
-# Example Usage:
-filename = "Naruto Shippuden S01 - EP07 - 1080p [Dual Audio] @Madflix_Bots.mkv"
-episode_number = extract_episode_number(filename)
-print(f"Extracted Episode Number: {episode_number}")
+
+class RenameJob:
+    """One incoming file on its way through the rename pipeline."""
+
+    def __init__(self, message, dedup_key, media_type, file_name, trace):
+        self.message = message
+        self.media = message.document or message.video or message.audio
+        self.dedup_key = dedup_key
+        self.media_type = media_type
+        self.file_name = file_name
+        self.trace = trace
+        self.new_file_name = None
+        self.result_key = None
+        self.scratch = None
+
+    @property
+    def streamable(self):
+        # Streaming skips the metadata read, so a file turned into a video
+        # or audio needs the duration Telegram already knows
+        size = self.media.file_size or 0
+        return (
+            Config.STREAM_TRANSFER
+            and size >= max(Config.STREAM_MIN_MB * MB, BIG_FILE_SIZE + 1)
+            and (self.media_type == "document" or getattr(self.media, "duration", 0))
+        )
+
+    def reserve(self, size=None):
+        # Queued for disk space right away; released (and the file with it)
+        # by close(), whatever happens in between
+        self.trace.record("queue", time.monotonic() - self.trace.created)
+        self.scratch = reserve_scratch(self.media.file_size if size is None else size)
+        return self.scratch
+
+    def close(self):
+        # Start the short "renamed recently" window once the job is over
+        renaming_operations.finish(self.dedup_key)
+        job_queue.update(self.dedup_key, "done" if self.trace.outcome == "done" else "failed")
+        if self.scratch is not None:
+            self.scratch.release()
+        self.trace.finish("failed")  # no-op unless the job died on an unexpected error
+
 
 # Inside the handler for file uploads
 @Client.on_message(filters.private & (filters.document | filters.video | filters.audio))
 async def auto_rename_files(client, message):
     user_id = message.from_user.id
-    firstname = message.from_user.first_name
-    format_template = await madflixbotz.get_format_template(user_id)
-    media_preference = await madflixbotz.get_media_preference(user_id)
+    media = message.document or message.video or message.audio
+    if media is None:
+        return await message.reply_text("Unsupported File Type")
 
-    if not format_template:
-        return await message.reply_text("Please Set An Auto Rename Format First Using /autorename")
+    # Check whether the file is already being renamed or has been renamed
+    # recently, and mark it as being renamed if not
+    dedup_key = (user_id, media.file_unique_id)
+    if not renaming_operations.claim(dedup_key):
+        logger.info("Ignoring %s from %s: it is being renamed or was renamed recently", media.file_name, user_id)
+        return  # Exit the handler if the file is being ignored
+
+    # Stored with the job so a worker on another session can reach the chat
+    access_hash = None
+    if Config.JOB_QUEUE:
+        access_hash = getattr(await client.resolve_peer(message.chat.id), "access_hash", None)
+
+    # While restarting, leave the file to the next process
+    if scheduler.draining:
+        renaming_operations.discard(dedup_key)
+        try:
+            if Config.JOB_QUEUE and await job_queue.enqueue(dedup_key, message, owned=False, access_hash=access_hash):
+                return await message.reply_text("Bot Is Restarting, Your File Will Be Renamed As Soon As It Is Back.....")
+        except Exception as e:
+            logger.warning("Could not queue %s for after the restart: %s", media.file_name, e)
+        return await message.reply_text("Bot Is Restarting, Please Send The File Again In A Minute.....")
+
+    # Sharded mode: the worker for this user's shard renames the file
+    if supervisor is not None:
+        shard = shard_of(user_id, supervisor.count)
+        try:
+            queued = await job_queue.enqueue(dedup_key, message, owned=False, shard=shard, access_hash=access_hash)
+        except Exception as e:
+            logger.warning("Could not queue %s for worker %s, renaming it here: %s", media.file_name, shard, e)
+        else:
+            # The jobs index keeps the file from being renamed twice from here on
+            renaming_operations.discard(dedup_key)
+            if queued:
+                supervisor.notify(shard)
+            return
+
+    # Recorded in Mongo so a restart or another worker can pick it up
+    if not await job_queue.enqueue(dedup_key, message, access_hash=access_hash):
+        renaming_operations.discard(dedup_key)
+        logger.info("Ignoring %s from %s: another worker is renaming it", media.file_name, user_id)
+        return
+
+    # Files of one album, or sent close together, become one batch
+    batcher.add((user_id, message.media_group_id), (client, message, dedup_key))
+
+
+@job_queue.on_resume
+async def resume_file(client, message, dedup_key):
+    # A job whose worker died; it starts over from the download
+    if not renaming_operations.claim(dedup_key):
+        # The same file is being renamed here already, or just was; end
+        # the job so its lease isn't renewed forever and it doesn't block
+        # the file in the jobs index
+        logger.info("Dropping job for %s: the file is being renamed or was renamed recently", dedup_key)
+        job_queue.update(dedup_key, "failed", "duplicate")
+        return
+    batcher.add((dedup_key[0], message.media_group_id), (client, message, dedup_key))
+
+
+async def process_files(key, items):
+    """Turn a batch of incoming files into rename jobs and queue them.
+
+    A file that fails before it reaches the scheduler is abandoned, so the
+    user can send it again and its job doesn't hold a lease forever.
+    """
+    client, message, _ = items[0]
+    user_id = message.from_user.id
+    try:
+        # Everything the batch needs from the user's settings, in one query
+        settings = await madflixbotz.get_user_settings(user_id)
+        format_template = settings.format_template
+
+        if not format_template:
+            for _, _, dedup_key in items:
+                renaming_operations.discard(dedup_key)
+                job_queue.update(dedup_key, "failed", "no format template")
+            return await message.reply_text("Please Set An Auto Rename Format First Using /autorename")
+
+        # Templates set before they were compiled at /autorename get compiled
+        # (and saved) on their first upload
+        format_compiled = settings.format_compiled
+        if format_compiled is None:
+            try:
+                format_compiled = compile_template(format_template)
+            except TemplateError as e:
+                for _, _, dedup_key in items:
+                    renaming_operations.discard(dedup_key)
+                    job_queue.update(dedup_key, "failed", e)
+                return await message.reply_text(f"Your Auto Rename Format Is Invalid, Set It Again Using /autorename\n\n{e}")
+            await madflixbotz.update_user_settings(user_id, format_compiled=format_compiled)
+        tokens = template_tokens(format_compiled)
+    except Exception as e:
+        return await abandon_files(items, e)
+
+    jobs = []
+    for item in items:
+        client, message, dedup_key = item
+        try:
+            job = await prepare_job(client, message, dedup_key, settings, format_compiled, tokens)
+        except Exception as e:
+            await abandon_files([item], e)
+            continue
+        if job is not None:
+            jobs.append(job)
+    if not jobs:
+        return
+
+    # Hand the transfers over to the scheduler so bursts of files queue up
+    # instead of all downloading at once
+    try:
+        status_msg = await jobs[0].message.reply_text(text="Trying To Download.....")
+    except Exception as e:
+        for job in jobs:
+            job.trace.finish("failed")
+        return await abandon_files([(client, job.message, job.dedup_key) for job in jobs], e)
+    if len(jobs) == 1:
+        factory = partial(rename_file, client, jobs[0], settings, status_msg)
+    else:
+        factory = partial(rename_batch, client, jobs, settings, status_msg)
+    position = scheduler.submit(user_id, factory)
+    if position:
+        await status_msg.edit(f"Your File Is Queued.....\n\n<b>Position In Queue :</b> {position}")
+
+
+async def abandon_files(items, error):
+    """Give up on files that never reached the scheduler: drop their dedup
+    claims and fail their jobs, then tell the user."""
+    logger.error("Could not queue %d file(s)", len(items), exc_info=error)
+    for _, _, dedup_key in items:
+        renaming_operations.discard(dedup_key)
+        job_queue.update(dedup_key, "failed", error)
+    try:
+        await items[0][1].reply_text("Something Went Wrong With Your File, Please Send It Again.....")
+    except Exception:
+        pass
+
+
+batcher = Batcher(Config.BATCH_WINDOW, Config.BATCH_MAX_FILES, process_files)
+on_drain(batcher.flush_all)  # their jobs get queued, then handed over
+
+
+async def prepare_job(client, message, dedup_key, settings, format_compiled, tokens):
+    """Work out one file's new name; returns None when it was handled
+    without a transfer (fast path, cached result) or cannot be renamed."""
+    user_id = message.from_user.id
+    media_preference = settings.media_type
 
     # Extract information from the incoming file name
     if message.document:
-        file_id = message.document.file_id
         file_name = message.document.file_name
         media_type = media_preference or "document"  # Use preferred media type or default to document
     elif message.video:
-        file_id = message.video.file_id
         file_name = f"{message.video.file_name}.mp4"
         media_type = media_preference or "video"  # Use preferred media type or default to video
-    elif message.audio:
-        file_id = message.audio.file_id
+    else:
         file_name = f"{message.audio.file_name}.mp3"
         media_type = media_preference or "audio"  # Use preferred media type or default to audio
-    else:
-        return await message.reply_text("Unsupported File Type")
 
-    print(f"Original File Name: {file_name}")
-    
-    
-
-# Check whether the file is already being renamed or has been renamed recently
-    if file_id in renaming_operations:
-        elapsed_time = (datetime.now() - renaming_operations[file_id]).seconds
-        if elapsed_time < 10:
-            print("File is being ignored as it is currently being renamed or was renamed recently.")
-            return  # Exit the handler if the file is being ignored
-
-    # Mark the file as currently being renamed
-    renaming_operations[file_id] = datetime.now()
+    logger.debug("Original File Name: %s", file_name)
+    media = message.document or message.video or message.audio
+    trace = JobTrace(user_id, media_type, media.file_size)
 
-    # Extract episode number and qualities
-    episode_number = extract_episode_number(file_name)
+    # Extract episode number and qualities in a single pass over the name
+    with trace.span("parse"):
+        parsed = parse_filename(file_name)
+    episode_number = parsed.episode
     
-    print(f"Extracted Episode Number: {episode_number}")
+    logger.debug("Extracted Episode Number: %s (Pattern %s)", episode_number, parsed.episode_pattern)
     
-    if episode_number:
-        placeholders = ["episode", "Episode", "EPISODE", "{episode}"]
-        for placeholder in placeholders:
-            format_template = format_template.replace(placeholder, str(episode_number), 1)
-            
-        # Add extracted qualities to the format template
-        quality_placeholders = ["quality", "Quality", "QUALITY", "{quality}"]
-        for quality_placeholder in quality_placeholders:
-            if quality_placeholder in format_template:
-                extracted_qualities = extract_quality(file_name)
-                if extracted_qualities == "Unknown":
-                    await message.reply_text("I Was Not Able To Extract The Quality Properly. Renaming As 'Unknown'...")
-                    # Mark the file as ignored
-                    del renaming_operations[file_id]
-                    return  # Exit the handler if quality extraction fails
-                
-                format_template = format_template.replace(quality_placeholder, "".join(extracted_qualities))           
-            
-        _, file_extension = os.path.splitext(file_name)
-        new_file_name = f"{format_template}{file_extension}"
-        file_path = f"downloads/{new_file_name}"
-        file = message
-
-        download_msg = await message.reply_text(text="Trying To Download.....")
-        try:
-            path = await client.download_media(message=file, file_name=file_path, progress=progress_for_pyrogram, progress_args=("Download Started....", download_msg, time.time()))
-        except Exception as e:
+    if not episode_number and "episode" in tokens:
+        renaming_operations.finish(dedup_key)
+        job_queue.update(dedup_key, "failed", "no episode number")
+        trace.finish("no_episode")
+        return None
+
+    if "quality" in tokens:
+        extracted_qualities = parsed.quality or "Unknown"
+        logger.debug("Quality: %s", extracted_qualities)
+        if extracted_qualities == "Unknown":
+            trace.finish("unknown_quality")
+            await message.reply_text("I Was Not Able To Extract The Quality Properly. Renaming As 'Unknown'...")
             # Mark the file as ignored
-            del renaming_operations[file_id]
-            return await download_msg.edit(e)     
-
-        duration = 0
+            renaming_operations.discard(dedup_key)
+            job_queue.update(dedup_key, "failed", "unknown quality")
+            return None  # Skip the file if quality extraction fails
+
+    # One pass over the compiled template
+    _, file_extension = os.path.splitext(file_name)
+    new_file_name = render_template(format_compiled, parsed, file_extension)
+
+    if await try_fast_rename(client, message, new_file_name, media_type, settings, trace):
+        renaming_operations.finish(dedup_key)
+        job_queue.update(dedup_key, "done")
+        return None
+
+    result_key = rename_results.key(media.file_unique_id, new_file_name, thumb_file_id(message, media_type, settings), media_type)
+    if await try_cached_result(client, message, result_key, new_file_name, settings, trace):
+        renaming_operations.finish(dedup_key)
+        job_queue.update(dedup_key, "done")
+        return None
+
+    job = RenameJob(message, dedup_key, media_type, file_name, trace)
+    job.new_file_name = new_file_name
+    job.result_key = result_key
+    return job
+
+
+async def try_fast_rename(client, message, new_file_name, media_type, settings, trace):
+    """Re-send the stored file by file_id when nothing about the file itself
+    changes, skipping the download and upload entirely.
+
+    Telegram keeps the file name and thumbnail attached to the stored file,
+    so this only applies when the rendered name equals the original one, the
+    media type is unchanged and the user has no custom thumbnail. Only the
+    caption can differ.
+    """
+    if not Config.FAST_RENAME:
+        return False
+    media = message.document or message.video or message.audio
+    source_type = "document" if message.document else "video" if message.video else "audio"
+    if media_type != source_type or new_file_name != media.file_name:
+        return False
+    if settings.thumbnail:
+        return False
+
+    duration = getattr(media, "duration", 0) or 0
+    try:
+        caption = build_caption(settings, new_file_name, media.file_size, duration)
+        with trace.span("upload"):
+            await client.send_cached_media(message.chat.id, media.file_id, caption=caption)
+    except Exception as e:
+        logger.warning("Fast rename failed, falling back to full rename: %s", e)
+        return False
+    RENAME_PATHS.inc(path="fast")
+    trace.finish("fast")
+    return True
+
+
+async def try_cached_result(client, message, result_key, new_file_name, settings, trace):
+    """Re-send the output of an identical earlier rename, if there was one."""
+    if not Config.RESULT_CACHE:
+        return False
+    with trace.span("result_cache"):
+        result = await rename_results.get(result_key)
+    if result is None:
+        return False
+    media = message.document or message.video or message.audio
+    try:
+        caption = build_caption(settings, new_file_name, media.file_size, result.get("duration") or 0)
+    except Exception as e:
+        # A broken caption template; not the cached file's fault, so keep it
+        logger.warning("Caption could not be built, renaming again: %s", e)
+        return False
+    try:
+        with trace.span("upload"):
+            await client.send_cached_media(message.chat.id, result["file_id"], caption=caption)
+    except Exception as e:
+        logger.warning("Cached result could not be re-sent, renaming again: %s", e)
+        await rename_results.forget(result_key)
+        return False
+    RENAME_PATHS.inc(path="cached")
+    trace.finish("cached")
+    return True
+
+
+async def download_job(client, job, progress):
+    """Download one job's file into its scratch reservation and read its
+    metadata; returns (file_path, duration)."""
+    trace = job.trace
+    with trace.span("disk"):
+        await job.scratch.acquire()
+    file_path = job.scratch.file(job.new_file_name)
+    size = job.media.file_size or 0
+    async with scheduler.download_slot:
+        job_queue.update(job.dedup_key, "downloading")
+        with trace.span("download"):
+            if Config.DOWNLOAD_WORKERS > 1 and size >= Config.PARALLEL_MIN_MB * MB:
+                await parallel_download(
+                    client, job.message, file_path, size, connections=Config.DOWNLOAD_CONNECTIONS,
+                    workers=Config.DOWNLOAD_WORKERS, retries=Config.TRANSFER_RETRIES, progress=progress,
+                )
+            else:
+                await client.download_media(message=job.message, file_name=file_path, progress=progress)
+
+    # Parsed in a worker pool so a slow MKV can't stall other users
+    with trace.span("metadata"):
+        metadata = await extract_metadata(file_path, fallback={"duration": getattr(job.media, "duration", 0) or 0})
+    return file_path, metadata["duration"]
+
+
+async def stream_job(client, job, settings, progress):
+    """Upload the file while it downloads, through a bounded buffer
+    (STREAM_MEMORY_MB in memory, then up to STREAM_SPILL_MB on disk)."""
+    with job.trace.span("disk"):
+        await job.scratch.acquire()
+    buffer = StreamBuffer(Config.STREAM_MEMORY_MB * MB, Config.STREAM_SPILL_MB * MB, job.scratch.file("stream.spill"))
+    source = StreamingUpload(
+        client, job.message, job.new_file_name, job.media.file_size, buffer,
+        connections=Config.UPLOAD_CONNECTIONS, workers=Config.UPLOAD_WORKERS, retries=Config.TRANSFER_RETRIES,
+        download_progress=ProgressReporter(None, "", direction="download").update,
+    )
+    try:
+        # Both transfers run at once, so hold a slot of each
+        async with scheduler.download_slot:
+            await upload_job(client, job, settings, source, getattr(job.media, "duration", 0) or 0, progress)
+    finally:
+        buffer.discard()
+
+
+async def upload_job(client, job, settings, file_path, duration, progress, ph_path=None):
+    """Send a downloaded file under its new name and remember the result."""
+    message = job.message
+    trace = job.trace
+    caption = build_caption(settings, job.new_file_name, job.media.file_size, duration)
+
+    # Processed thumbnails are cached on disk by file_id, so a fixed
+    # custom thumbnail is only downloaded and encoded once
+    thumb_id = thumb_file_id(message, job.media_type, settings)
+    if thumb_id and ph_path is None:
         try:
-            metadata = extractMetadata(createParser(file_path))
-            if metadata.has("duration"):
-                duration = metadata.get('duration').seconds
+            with trace.span("thumb"):
+                ph_path = await thumbnails.get(client, thumb_id)
         except Exception as e:
-            print(f"Error getting duration: {e}")
-
-        upload_msg = await download_msg.edit("Trying To Uploading.....")
-        ph_path = None
-        c_caption = await madflixbotz.get_caption(message.chat.id)
-        c_thumb = await madflixbotz.get_thumbnail(message.chat.id)
-
-        caption = c_caption.format(filename=new_file_name, filesize=humanbytes(message.document.file_size), duration=convert(duration)) if c_caption else f"**{new_file_name}**"
-
-        if c_thumb:
-            ph_path = await client.download_media(c_thumb)
-            print(f"Thumbnail downloaded successfully. Path: {ph_path}")
-        elif media_type == "video" and message.video.thumbs:
-            ph_path = await client.download_media(message.video.thumbs[0].file_id)
-
-        if ph_path:
-            Image.open(ph_path).convert("RGB").save(ph_path)
-            img = Image.open(ph_path)
-            img.resize((320, 320))
-            img.save(ph_path, "JPEG")    
-        
-
-        try:
-            type = media_type  # Use 'media_type' variable instead
+            logger.warning("Error preparing thumbnail: %s", e)
+
+    # Big files go up over several connections with per-part retries;
+    # send_* finishes them through the bot's save_file override
+    if isinstance(file_path, str) and Config.UPLOAD_WORKERS > 1 and os.path.getsize(file_path) >= max(Config.PARALLEL_MIN_MB * MB, BIG_FILE_SIZE + 1):
+        file_path = ParallelUpload(
+            file_path, job.new_file_name, connections=Config.UPLOAD_CONNECTIONS,
+            workers=Config.UPLOAD_WORKERS, retries=Config.TRANSFER_RETRIES,
+        )
+
+    sent = None
+    type = job.media_type  # Use 'media_type' variable instead
+    async with scheduler.upload_slot:
+        job_queue.update(job.dedup_key, "uploading")
+        with trace.span("upload"):
             if type == "document":
-                await client.send_document(
+                sent = await client.send_document(
                     message.chat.id,
                     document=file_path,
+                    file_name=job.new_file_name,
                     thumb=ph_path,
                     caption=caption,
-                    progress=progress_for_pyrogram,
-                    progress_args=("Upload Started.....", upload_msg, time.time())
+                    progress=progress
                 )
             elif type == "video":
-                await client.send_video(
+                sent = await client.send_video(
                     message.chat.id,
                     video=file_path,
+                    file_name=job.new_file_name,
                     caption=caption,
                     thumb=ph_path,
                     duration=duration,
-                    progress=progress_for_pyrogram,
-                    progress_args=("Upload Started.....", upload_msg, time.time())
+                    progress=progress
                 )
             elif type == "audio":
-                await client.send_audio(
+                sent = await client.send_audio(
                     message.chat.id,
                     audio=file_path,
+                    file_name=job.new_file_name,
                     caption=caption,
                     thumb=ph_path,
                     duration=duration,
-                    progress=progress_for_pyrogram,
-                    progress_args=("Upload Started.....", upload_msg, time.time())
+                    progress=progress
                 )
+    # The key promises the thumbnail; an upload without it must not be reused
+    if Config.RESULT_CACHE and not (thumb_id and ph_path is None):
+        await rename_results.save(job.result_key, sent, duration)
+
+
+async def rename_file(client, job, settings, download_msg):
+    streaming = job.streamable
+    scratch = job.reserve(min(job.media.file_size, Config.STREAM_SPILL_MB * MB) if streaming else None)
+    trace = job.trace
+    try:
+        RENAME_PATHS.inc(path="full")
+        if not scratch.ready:
+            await download_msg.edit("Waiting For Free Disk Space.....")
+        else:
+            await download_msg.edit("Trying To Download.....")
+
+        if streaming:
+            try:
+                with trace.span("stream"):
+                    await stream_job(client, job, settings, ProgressReporter(download_msg, "Renaming (Download + Upload)....", direction="upload").update)
+            except Exception as e:
+                trace.finish("failed")
+                return await download_msg.edit(f"Error: {e}")
+            trace.finish("done")
+            return await download_msg.delete()
+        try:
+            file_path, duration = await download_job(client, job, ProgressReporter(download_msg, "Download Started....", direction="download").update)
         except Exception as e:
-            os.remove(file_path)
-            if ph_path:
-                os.remove(ph_path)
-            # Mark the file as ignored
+            trace.finish("failed")
+            return await download_msg.edit(e)     
+
+        upload_msg = await download_msg.edit("Trying To Uploading.....")
+        try:
+            await upload_job(client, job, settings, file_path, duration, ProgressReporter(upload_msg, "Upload Started.....", direction="upload").update)
+        except Exception as e:
+            trace.finish("failed")
             return await upload_msg.edit(f"Error: {e}")
 
+        trace.finish("done")
         await download_msg.delete() 
-        os.remove(file_path)
-        if ph_path:
-            os.remove(ph_path)
+    finally:
+        job.close()
+
+
+async def rename_batch(client, jobs, settings, status_msg):
+    """Rename several files as one job: the next file downloads while the
+    previous one uploads, with at most BATCH_PREFETCH files waiting on disk
+    in between, and a single status message for all of them."""
+    progress = BatchProgress(status_msg, len(jobs), sum(job.media.file_size or 0 for job in jobs))
+    ready = asyncio.Queue(maxsize=Config.BATCH_PREFETCH)
+    errors = []
+
+    # A custom thumbnail is the same for every file; prepare it once
+    ph_path = None
+    if settings.thumbnail:
+        try:
+            ph_path = await thumbnails.get(client, settings.thumbnail)
+        except Exception as e:
+            logger.warning("Error preparing thumbnail: %s", e)
+
+    async def downloader():
+        for job in jobs:
+            job.reserve()
+            RENAME_PATHS.inc(path="full")
+            try:
+                file_path, duration = await download_job(client, job, progress.tracker("download"))
+            except Exception as e:
+                errors.append(f"{job.file_name} : {e}")
+                progress.failed += 1
+                job.trace.finish("failed")
+                job.close()
+                continue
+            progress.file_done("download", job.media.file_size)
+            await ready.put((job, file_path, duration))
+        await ready.put(None)
+
+    download_task = asyncio.create_task(downloader())
+    try:
+        await progress.refresh()
+        while True:
+            item = await ready.get()
+            if item is None:
+                break
+            job, file_path, duration = item
+            try:
+                await upload_job(client, job, settings, file_path, duration, progress.tracker("upload"), ph_path)
+                job.trace.finish("done")
+                progress.file_done("upload", job.media.file_size)
+            except Exception as e:
+                errors.append(f"{job.new_file_name} : {e}")
+                progress.failed += 1
+                job.trace.finish("failed")
+            finally:
+                job.close()
+            await progress.refresh()
+    finally:
+        download_task.cancel()
+        for job in jobs:
+            job.close()
+
+    if errors:
+        await status_msg.edit(f"Renamed {progress.uploaded} Of {len(jobs)} Files.\n\n" + "\n".join(f"Error: {error}" for error in errors[:10]))
+    else:
+        await status_msg.delete()
 
-# Remove the entry from renaming_operations after successful renaming
-        del renaming_operations[file_id]
 
 
 
@@ -3,33 +3,110 @@ from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from pyrogram.errors import UserNotParticipant
 from config import Config
 from helper.database import madflixbotz
+from helper.cache import TTLCache
+from helper.metrics import CACHES
+import asyncio
+import time
+
+# Membership states we cache, each with its own TTL: members rarely leave,
+# while someone who was just told to join should be re-checked quickly.
+MEMBER, NOT_MEMBER, BANNED = "member", "not_member", "banned"
+MEMBERSHIP_TTL = {
+    MEMBER: Config.FORCE_SUB_MEMBER_TTL,
+    NOT_MEMBER: Config.FORCE_SUB_NOT_MEMBER_TTL,
+    BANNED: Config.FORCE_SUB_BANNED_TTL,
+}
+# Refresh in the background once this share of an entry's TTL has passed,
+# so active users never wait on get_chat_member.
+REFRESH_AFTER = 0.8
+
+membership_cache = TTLCache(Config.FORCE_SUB_CACHE_SIZE, Config.FORCE_SUB_MEMBER_TTL)
+_lookups = {}  # user_id -> in-flight get_chat_member task
+CACHES.register("membership", membership_cache)
+
+
+async def _fetch_membership(client, user_id):
+    try:
+        user = await client.get_chat_member(Config.FORCE_SUB, user_id)
+    except UserNotParticipant:
+        status = NOT_MEMBER
+    else:
+        status = BANNED if user.status == enums.ChatMemberStatus.BANNED else MEMBER
+    _store_membership(user_id, status)
+    return status
+
+
+def _store_membership(user_id, status):
+    ttl = MEMBERSHIP_TTL[status]
+    membership_cache.set(user_id, (status, time.monotonic() + ttl * REFRESH_AFTER), ttl=ttl)
+
+
+def _lookup(client, user_id):
+    # Coalesce concurrent lookups: a burst of 30 files from one user shares
+    # a single get_chat_member call.
+    task = _lookups.get(user_id)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_membership(client, user_id))
+        _lookups[user_id] = task
+        task.add_done_callback(lambda _: _lookups.pop(user_id, None))
+    return task
+
+
+async def get_membership(client, user_id):
+    entry = membership_cache.get(user_id)
+    if entry is None:
+        # Shielded so one cancelled handler does not cancel the shared lookup
+        return await asyncio.shield(_lookup(client, user_id))
+    status, refresh_at = entry
+    if time.monotonic() >= refresh_at and user_id not in _lookups:
+        _lookup(client, user_id).add_done_callback(_ignore_failure)
+    return status
+
+
+def _ignore_failure(task):
+    # Background refreshes keep serving the cached status if they fail
+    if not task.cancelled():
+        task.exception()
+
+
+def _is_force_sub_chat(chat):
+    target = str(Config.FORCE_SUB).lstrip("@").lower()
+    return str(chat.id) == target or (chat.username or "").lower() == target
+
 
 async def not_subscribed(_, client, message):
     await madflixbotz.add_user(client, message)
     if not Config.FORCE_SUB:
         return False
-    try:             
-        user = await client.get_chat_member(Config.FORCE_SUB, message.from_user.id) 
-        if user.status == enums.ChatMemberStatus.BANNED:
-            return True 
-        else:
-            return False                
-    except UserNotParticipant:
-        pass
-    return True
+    return await get_membership(client, message.from_user.id) != MEMBER
 
 
 @Client.on_message(filters.private & filters.create(not_subscribed))
 async def forces_sub(client, message):
     buttons = [[InlineKeyboardButton(text="🔺 Update Channel 🔺", url=f"https://t.me/{Config.FORCE_SUB}") ]]
     text = "<b>Hello Dear \n\nYou Need To Join In My Channel To Use Me\n\nKindly Please Join Channel</b>"
-    try:
-        user = await client.get_chat_member(Config.FORCE_SUB, message.from_user.id)    
-        if user.status == enums.ChatMemberStatus.BANNED:                                   
-            return await client.send_message(message.from_user.id, text="Sorry You Are Banned To Use Me")  
-    except UserNotParticipant:                       
-        return await message.reply_text(text=text, reply_markup=InlineKeyboardMarkup(buttons))
+    # The filter has just cached the status, so this costs no API call
+    if await get_membership(client, message.from_user.id) == BANNED:
+        return await client.send_message(message.from_user.id, text="Sorry You Are Banned To Use Me")  
     return await message.reply_text(text=text, reply_markup=InlineKeyboardMarkup(buttons))
+
+
+@Client.on_chat_member_updated()
+async def force_sub_member_updated(client, update):
+    # Only delivered when the bot is an admin of the channel; keeps the cache
+    # exact instead of waiting for the TTL after someone joins or leaves.
+    if not Config.FORCE_SUB or not _is_force_sub_chat(update.chat):
+        return
+    new = update.new_chat_member
+    member = new or update.old_chat_member
+    if member is None or member.user is None:
+        return
+    if new is None or new.status == enums.ChatMemberStatus.LEFT:
+        _store_membership(member.user.id, NOT_MEMBER)
+    elif new.status == enums.ChatMemberStatus.BANNED:
+        _store_membership(member.user.id, BANNED)
+    else:
+        _store_membership(member.user.id, MEMBER)
           
 
 
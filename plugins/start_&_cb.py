@@ -76,9 +76,9 @@ async def cb_handler(client, query: CallbackQuery):
         )
     
     elif data == "file_names":
-        format_template = await madflixbotz.get_format_template(user_id)
+        settings = await madflixbotz.get_user_settings(user_id, fields=("format_template",))
         await query.message.edit_text(
-            text=Txt.FILE_NAME_TXT.format(format_template=format_template),
+            text=Txt.FILE_NAME_TXT.format(format_template=settings.format_template),
             disable_web_page_preview=True,
             reply_markup=InlineKeyboardMarkup([[
                 InlineKeyboardButton("✖️ Close", callback_data="close"),
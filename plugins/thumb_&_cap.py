@@ -6,43 +6,43 @@ async def add_caption(client, message):
     if len(message.command) == 1:
        return await message.reply_text("**Give The Caption\n\nExample :- `/set_caption 📕Name ➠ : {filename} \n\n🔗 Size ➠ : {filesize} \n\n⏰ Duration ➠ : {duration}`**")
     caption = message.text.split(" ", 1)[1]
-    await madflixbotz.set_caption(message.from_user.id, caption=caption)
+    await madflixbotz.update_user_settings(message.from_user.id, caption=caption)
     await message.reply_text("**Your Caption Successfully Added ✅**")
    
 @Client.on_message(filters.private & filters.command('del_caption'))
 async def delete_caption(client, message):
-    caption = await madflixbotz.get_caption(message.from_user.id)  
-    if not caption:
+    settings = await madflixbotz.get_user_settings(message.from_user.id, fields=("caption",))
+    if not settings.caption:
        return await message.reply_text("**You Don't Have Any Caption ❌**")
-    await madflixbotz.set_caption(message.from_user.id, caption=None)
+    await madflixbotz.update_user_settings(message.from_user.id, caption=None)
     await message.reply_text("**Your Caption Successfully Deleted 🗑️**")
                                        
 @Client.on_message(filters.private & filters.command(['see_caption', 'view_caption']))
 async def see_caption(client, message):
-    caption = await madflixbotz.get_caption(message.from_user.id)  
-    if caption:
-       await message.reply_text(f"**Your Caption :**\n\n`{caption}`")
+    settings = await madflixbotz.get_user_settings(message.from_user.id, fields=("caption",))
+    if settings.caption:
+       await message.reply_text(f"**Your Caption :**\n\n`{settings.caption}`")
     else:
        await message.reply_text("**You Don't Have Any Caption ❌**")
 
 
 @Client.on_message(filters.private & filters.command(['view_thumb', 'viewthumb']))
 async def viewthumb(client, message):    
-    thumb = await madflixbotz.get_thumbnail(message.from_user.id)
-    if thumb:
-       await client.send_photo(chat_id=message.chat.id, photo=thumb)
+    settings = await madflixbotz.get_user_settings(message.from_user.id, fields=("thumbnail",))
+    if settings.thumbnail:
+       await client.send_photo(chat_id=message.chat.id, photo=settings.thumbnail)
     else:
         await message.reply_text("**You Don't Have Any Thumbnail ❌**") 
 		
 @Client.on_message(filters.private & filters.command(['del_thumb', 'delthumb']))
 async def removethumb(client, message):
-    await madflixbotz.set_thumbnail(message.from_user.id, file_id=None)
+    await madflixbotz.update_user_settings(message.from_user.id, thumbnail=None)
     await message.reply_text("**Thumbnail Deleted Successfully 🗑️**")
 	
 @Client.on_message(filters.private & filters.photo)
 async def addthumbs(client, message):
     mkn = await message.reply_text("Please Wait ...")
-    await madflixbotz.set_thumbnail(message.from_user.id, file_id=message.photo.file_id)                
+    await madflixbotz.update_user_settings(message.from_user.id, thumbnail=message.photo.file_id)                
     await mkn.edit("**Thumbnail Saved Successfully ✅️**")
 
 
@@ -0,0 +1,31 @@
+import unittest
+from unittest import mock
+
+from plugins import file_rename
+from plugins.file_rename import job_queue, process_files, renaming_operations
+
+
+class ProcessFilesTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_settings_error_releases_the_files(self):
+        message = mock.MagicMock()
+        message.from_user.id = 42
+        message.reply_text = mock.AsyncMock()
+        key = (42, "unique-id")
+        self.assertTrue(renaming_operations.claim(key))
+        job_queue.local[key] = "job-id"
+
+        with mock.patch.object(file_rename.madflixbotz, "get_user_settings", side_effect=RuntimeError("mongo down")), \
+                mock.patch.object(file_rename.madflixbotz, "update_job", return_value=True) as update_job:
+            await process_files(None, [(None, message, key)])
+            await job_queue.flush()
+
+        # The job is failed and forgotten, and sending the file again works
+        self.assertNotIn(key, job_queue.local)
+        self.assertEqual(update_job.call_args.args[2]['state'], "failed")
+        self.assertTrue(renaming_operations.claim(key))
+        message.reply_text.assert_awaited_once()
+
+
+if __name__ == "__main__":
+    unittest.main()